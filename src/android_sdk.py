@@ -1,11 +1,14 @@
 import subprocess
-import os, stat, platform
+import os, platform
+import socket
 import time
 import logging
 import re
 import requests, zipfile
 
 from clint.textui import progress
+from profiles import PROFILES, ProfileStore
+from archive import ZipExtractor
 
 logger = logging.getLogger('WhatsDump')
 
@@ -19,9 +22,14 @@ class CommandType:
 class AndroidSDK:
     AVD_NAME = 'WhatsDump'
 
+    # Emulator console ports (adb port is console port + 1)
+    MIN_EMULATOR_PORT = 5554
+    MAX_EMULATOR_PORT = 5682
+
     def __init__(self):
         self._sdk_path = os.path.abspath('android-sdk')
         self._env = self._get_env_vars()
+        self._emulators = {}
 
         # Update original environment var
         os.environ['ANDROID_HOME'] = self._env['ANDROID_HOME']
@@ -87,25 +95,56 @@ class AndroidSDK:
 
         return True
 
+    def get_profile_store(self):
+        return ProfileStore(os.path.join(self._sdk_path, 'emulator_profile.json'))
+
     def start_adb(self, port=5037):
         return self._run_cmd_adb('-P %d start-server' % port).returncode == 0
 
     def stop_adb(self):
         return self._run_cmd_adb('kill-server').returncode == 0
 
-    def start_emulator(self, adb_client, show_screen, no_accel):
+    def find_free_port(self, adb_client, start=MIN_EMULATOR_PORT):
+        """First even console port from start not used by any emulator (other processes included), None if all used"""
+        serials = set(device.serial for device in adb_client.devices())
+
+        for port in range(start + start % 2, self.MAX_EMULATOR_PORT + 1, 2):
+            if 'emulator-%d' % port in serials or self._is_port_bound(port) or self._is_port_bound(port + 1):
+                continue
+
+            return port
+
+        return None
+
+    def start_emulator(self, adb_client, show_screen, no_accel, port=None, read_only=False, profile=None):
         emulator_device = None
-        params = '-avd %s -no-boot-anim -noaudio -no-snapshot -partition-size 2047 '
+        profile = profile or PROFILES['default']
+        params = '-avd %s -no-boot-anim -noaudio -no-snapshot '
+        params += profile.params()
 
-        # Stop any running instance of WhatsDump AVD
-        #self.stop_emulator(adb_client)
+        logger.debug('Starting emulator with profile %s', profile.name)
 
-        # Snapshot of currently running devices
-        devices_snap = adb_client.devices()
+        # Never adopt an emulator started by someone else (e.g. a daemon or worker on this host):
+        # with a console port of our own, the device serial is known in advance
+        if not port:
+            port = self.find_free_port(adb_client)
+
+            if not port:
+                logger.error('No free emulator port left')
+                return False
+        elif 'emulator-%d' % port in set(device.serial for device in adb_client.devices()):
+            logger.error('Emulator port %d already used by a running emulator', port)
+            return False
 
         # Disable hardware acceleration if asked to
         if no_accel:
-            params += '-no-accel -gpu on '
+            params += '-no-accel ' if profile.gpu else '-no-accel -gpu on '
+
+        params += '-port %d ' % port
+
+        # Allow multiple instances of the same AVD
+        if read_only:
+            params += '-read-only '
 
         # Start emulator
         proc = self._run_cmd_emulator(params % self.AVD_NAME, show_screen,
@@ -113,22 +152,29 @@ class AndroidSDK:
 
         # Check if any emulator connects to ADB
         while not emulator_device:
-            if proc.returncode != None:
+            if proc.poll() is not None:
                 if proc.returncode != 0:
                     logger.error('Emulator process returned an error')
                     return False
 
                 break
 
-            new_devices = list(set(adb_client.devices()) - set(devices_snap))
-
-            for device in new_devices:
-                if device.serial.find('emulator') != -1:
+            for device in adb_client.devices():
+                if device.serial == 'emulator-%d' % port:
                     emulator_device = device
                     break
 
+            time.sleep(1)
+
+        if not emulator_device:
+            return False
+
         # Wait boot to complete
         while True:
+            if proc.poll() is not None:
+                logger.error('Emulator process exited during boot')
+                return False
+
             try:
                 if emulator_device.shell('getprop dev.bootcomplete').rstrip() == '1':
                     logger.debug('Emulator boot process completed')
@@ -138,16 +184,46 @@ class AndroidSDK:
 
             time.sleep(1)
 
+        self._emulators[emulator_device.serial] = proc
+
         return emulator_device
 
-    def stop_emulator(self, adb_client):
+    def stop_emulator(self, adb_client, serial=None):
         devices = adb_client.devices()
+        stopped = False
 
         for device in devices:
-            if device.serial.find('emulator') != -1:
-                return self._run_cmd_adb('-s %s emu kill' % device.serial).returncode == 0
+            if device.serial.find('emulator') == -1:
+                continue
 
-        return False
+            if serial and device.serial != serial:
+                continue
+
+            stopped = self._run_cmd_adb('-s %s emu kill' % device.serial).returncode == 0
+
+            if serial:
+                break
+
+        # Reap emulator processes started by us, so they do not linger
+        for proc_serial in list(self._emulators):
+            if serial and proc_serial != serial:
+                continue
+
+            proc = self._emulators.pop(proc_serial)
+
+            try:
+                for i in range(30):
+                    if proc.poll() is not None:
+                        break
+
+                    time.sleep(1)
+                else:
+                    proc.kill()
+                    proc.wait()
+            except OSError:
+                pass
+
+        return stopped
 
     def is_avd_installed(self):
         try:
@@ -167,10 +243,11 @@ class AndroidSDK:
 
     def _download(self, extract_dir):
         output_zip = os.path.join(extract_dir, 'tools.zip')
-        tools_dir = os.path.join(extract_dir, 'tools')
+        extractor = ZipExtractor(output_zip)
 
-        if os.path.exists(tools_dir):
-            logger.info('SDK tools directory already exists, skipping download & extraction...')
+        # Marker is written once extraction completed (with permissions restored)
+        if extractor.is_extracted(extract_dir):
+            logger.info('SDK tools already extracted, skipping download & extraction...')
             return True
 
         if not os.path.isfile(output_zip):
@@ -205,10 +282,13 @@ class AndroidSDK:
             logger.info('Android Tools already downloaded, extracting...')
 
         # Extraction
-        z = zipfile.ZipFile(output_zip)
-        z.extractall(extract_dir)
+        try:
+            files = extractor.extract(extract_dir)
+        except (zipfile.BadZipfile, IOError, OSError), e:
+            logger.error('Could not extract Android SDK: %s', e)
+            return False
 
-        logger.info('Android SDK successfully extracted in android-sdk/')
+        logger.info('Android SDK successfully extracted in android-sdk/ (%d files)', files)
 
         return True
 
@@ -249,10 +329,6 @@ class AndroidSDK:
     def _run_raw_cmd(self, cmd, wait=True, input=None, show=False):
         args = cmd.split()
 
-        # Set executable permission on linux if not set (zipfile not preserving permissions)
-        if platform.system() != 'Windows':
-            self._set_executable(args[0])
-
         # Run process
         proc = subprocess.Popen(args, env=self._env, cwd=self._sdk_path,
                                 stdin=subprocess.PIPE if input else None,
@@ -268,12 +344,17 @@ class AndroidSDK:
 
         return proc
 
-    def _set_executable(self, bin_path):
-        bin_path = os.path.join(self._sdk_path, bin_path)
-        st = os.stat(bin_path)
+    def _is_port_bound(self, port):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-        if not st.st_mode & stat.S_IEXEC:
-            os.chmod(bin_path, st.st_mode | stat.S_IEXEC)
+        try:
+            sock.bind(('127.0.0.1', port))
+        except socket.error:
+            return True
+        finally:
+            sock.close()
+
+        return False
 
     def _get_env_vars(self):
         new_env = os.environ.copy()
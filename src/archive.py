@@ -0,0 +1,123 @@
+import os
+import stat
+import zipfile
+import logging
+import platform
+
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger('WhatsDump')
+
+# ZipInfo.create_system of archives created on Unix (mode bits stored in high word of external_attr)
+ZIP_UNIX_SYSTEM = 3
+
+
+class ZipExtractor:
+    """Extracts zip members in parallel, restoring Unix permission bits and symlinks
+
+    A marker file is written in destination once every member is extracted: interrupted
+    extractions are detected and started over.
+    """
+
+    def __init__(self, zip_path, workers=4):
+        self.zip_path = zip_path
+        self.workers = workers
+
+    def marker_path(self, dst_path):
+        return os.path.join(dst_path, '.%s.extracted' % os.path.basename(self.zip_path))
+
+    def is_extracted(self, dst_path):
+        return os.path.isfile(self.marker_path(dst_path))
+
+    def extract(self, dst_path):
+        marker_path = self.marker_path(dst_path)
+
+        if os.path.exists(marker_path):
+            os.remove(marker_path)
+
+        z = zipfile.ZipFile(self.zip_path)
+
+        try:
+            members = z.infolist()
+        finally:
+            z.close()
+
+        # Directories first (listed or implied by member paths), so workers never race creating them
+        for z_dir in set(self._member_path(dst_path, os.path.dirname(info.filename)) for info in members):
+            if not os.path.isdir(z_dir):
+                os.makedirs(z_dir)
+
+        files = sorted([info for info in members if not info.filename.endswith('/')],
+                       key=lambda info: info.file_size, reverse=True)
+
+        # Balance workers by uncompressed size, biggest members first
+        groups = [[] for i in range(max(1, min(self.workers, len(files))))]
+        sizes = [0] * len(groups)
+
+        for info in files:
+            i = sizes.index(min(sizes))
+            groups[i].append(info)
+            sizes[i] += info.file_size
+
+        pool = ThreadPool(len(groups))
+
+        try:
+            pool.map(lambda group: self._extract_group(group, dst_path), groups)
+        finally:
+            pool.close()
+            pool.join()
+
+        with open(marker_path, 'wb') as f:
+            f.write('%d\n' % len(files))
+
+        return len(files)
+
+    def _extract_group(self, group, dst_path):
+        # ZipFile objects can not be shared between threads: one per worker
+        z = zipfile.ZipFile(self.zip_path)
+
+        try:
+            for info in group:
+                mode = (info.external_attr >> 16) & 0xFFFF if info.create_system == ZIP_UNIX_SYSTEM else 0
+
+                if stat.S_ISLNK(mode) and platform.system() != 'Windows':
+                    self._extract_symlink(z, info, dst_path)
+                    continue
+
+                path = z.extract(info, dst_path)
+
+                if mode & 0o7777 and platform.system() != 'Windows':
+                    os.chmod(path, mode & 0o7777)
+        finally:
+            z.close()
+
+    def _extract_symlink(self, z, info, dst_path):
+        path = self._member_path(dst_path, info.filename)
+        target = z.read(info)
+        root = os.path.abspath(dst_path)
+
+        # Links must stay inside destination, later members could be written through them
+        resolved = os.path.abspath(os.path.join(os.path.dirname(path), target))
+
+        if os.path.isabs(target) or not (resolved + os.path.sep).startswith(root + os.path.sep):
+            logger.warning('Skipping symlink %s pointing outside of %s', info.filename, dst_path)
+            return
+
+        if os.path.lexists(path):
+            os.remove(path)
+
+        os.symlink(target, path)
+
+    @staticmethod
+    def _member_path(dst_path, filename):
+        # Same sanitizing as ZipFile.extract: no absolute paths, drive letters or '..' components
+        filename = filename.replace('/', os.path.sep)
+
+        if os.path.altsep:
+            filename = filename.replace(os.path.altsep, os.path.sep)
+
+        filename = os.path.splitdrive(filename)[1]
+        filename = os.path.sep.join(x for x in filename.split(os.path.sep) if x not in ('', os.path.curdir,
+                                                                                       os.path.pardir))
+
+        return os.path.normpath(os.path.join(dst_path, filename))
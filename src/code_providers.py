@@ -0,0 +1,241 @@
+import os
+import re
+import sys
+import stat
+import time
+import select
+import socket
+import logging
+import threading
+import Queue
+import BaseHTTPServer
+import urlparse
+
+logger = logging.getLogger('WhatsDump')
+
+
+class CodeProviderException:
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def normalize_code(code):
+    """Returns 6-digit code, empty string to request a new one or None if not valid"""
+    code = re.sub(r'-\s*', '', code.strip())
+
+    if code == '' or (len(code) == 6 and code.isdigit()):
+        return code
+
+    return None
+
+
+class CodeProvider:
+    """Source of WhatsApp verification codes
+
+    get_code() returns the 6-digit code, or None to request a new SMS/call.
+    Raises CodeProviderException if no code arrives within timeout seconds (None waits forever).
+    """
+
+    POLL_INTERVAL = 1
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+
+    def get_code(self):
+        deadline = time.time() + self.timeout if self.timeout else None
+        self._prepare()
+
+        while True:
+            remaining = deadline - time.time() if deadline else self.POLL_INTERVAL
+
+            if remaining <= 0:
+                raise CodeProviderException('No verification code received within %d seconds' % self.timeout)
+
+            code = self._poll(min(remaining, self.POLL_INTERVAL))
+
+            if code is None:
+                continue
+
+            code = normalize_code(code)
+
+            if code is None:
+                logger.warning('Ignoring malformed verification code')
+                continue
+
+            # empty -> resend
+            return code or None
+
+    def close(self):
+        pass
+
+    def _prepare(self):
+        pass
+
+    def _poll(self, timeout):
+        """Returns raw code string if available, None otherwise (waits at most timeout seconds)"""
+        raise NotImplementedError
+
+
+class StdinCodeProvider(CodeProvider):
+    PROMPT = '\n>> 6-Digit Verification Code (empty string to resend): '
+
+    def _prepare(self):
+        sys.stdout.write(self.PROMPT)
+        sys.stdout.flush()
+
+    def _poll(self, timeout):
+        # select() does not work with pipes/consoles on Windows: block instead
+        if sys.platform == 'win32':
+            return raw_input()
+
+        readable, _, _ = select.select([sys.stdin], [], [], timeout)
+
+        if not readable:
+            return None
+
+        line = sys.stdin.readline()
+
+        if not line:
+            raise CodeProviderException('Standard input closed while waiting for verification code')
+
+        if normalize_code(line) is None:
+            self._prepare()
+
+        return line
+
+
+class FileCodeProvider(CodeProvider):
+    """Reads code from a watched file (consumed once read) or from a named pipe"""
+
+    def __init__(self, path, timeout=None):
+        CodeProvider.__init__(self, timeout)
+        self.path = path
+        self._fifo = None
+
+    def _prepare(self):
+        logger.info('Waiting for verification code in %s', self.path)
+
+        if os.path.exists(self.path) and stat.S_ISFIFO(os.stat(self.path).st_mode) and self._fifo is None:
+            # O_RDWR keeps the pipe open (no EOF) between writers
+            self._fifo = os.open(self.path, os.O_RDWR | os.O_NONBLOCK)
+
+    def _poll(self, timeout):
+        if self._fifo is not None:
+            return self._poll_fifo(timeout)
+
+        if not os.path.isfile(self.path):
+            time.sleep(timeout)
+            return None
+
+        with open(self.path, 'r+') as f:
+            line = f.readline()
+
+            # Wait until writer completed the line
+            if not line.endswith('\n'):
+                time.sleep(timeout)
+                return None
+
+            f.seek(0)
+            f.truncate()
+
+        return line
+
+    def _poll_fifo(self, timeout):
+        readable, _, _ = select.select([self._fifo], [], [], timeout)
+
+        if not readable:
+            return None
+
+        data = os.read(self._fifo, 64)
+
+        return data.splitlines()[0] if data else None
+
+    def close(self):
+        if self._fifo is not None:
+            os.close(self._fifo)
+            self._fifo = None
+
+
+class _CodeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_POST(self):
+        url = urlparse.urlparse(self.path)
+
+        if url.path == '/resend':
+            code = ''
+        elif url.path == '/code':
+            length = int(self.headers.getheader('content-length') or 0)
+            code = self.rfile.read(length) or urlparse.parse_qs(url.query).get('code', [''])[0]
+        else:
+            self.send_error(404)
+            return
+
+        if normalize_code(code) is None:
+            self.send_error(400, 'Malformed verification code')
+            return
+
+        self.server.codes.put(code)
+        self.send_response(202)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug('Code webhook: ' + format, *args)
+
+
+class HttpCodeProvider(CodeProvider):
+    """Local webhook: POST /code (body is the code) or POST /resend"""
+
+    def __init__(self, port, host='127.0.0.1', timeout=None):
+        CodeProvider.__init__(self, timeout)
+        self._server = BaseHTTPServer.HTTPServer((host, port), _CodeRequestHandler)
+        self._server.codes = Queue.Queue()
+
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def _prepare(self):
+        logger.info('Waiting for verification code on http://%s:%d/code', *self._server.server_address)
+
+    def _poll(self, timeout):
+        try:
+            return self._server.codes.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class CallbackCodeProvider(CodeProvider):
+    """Wraps a blocking callable returning the code (or None to resend)"""
+
+    def __init__(self, callback, timeout=None):
+        CodeProvider.__init__(self, timeout)
+        self._callback = callback
+
+    def get_code(self):
+        return self._callback()
+
+
+def create_code_provider(source, timeout=None):
+    """Builds provider from source spec: 'stdin', 'file:<path>' or 'http:[<host>:]<port>'"""
+    kind, _, value = source.partition(':')
+
+    if kind == 'stdin':
+        return StdinCodeProvider(timeout)
+
+    if kind == 'file' and value:
+        return FileCodeProvider(value, timeout)
+
+    if kind == 'http' and value:
+        host, _, port = value.rpartition(':')
+
+        try:
+            return HttpCodeProvider(int(port), host or '127.0.0.1', timeout)
+        except ValueError:
+            pass
+        except socket.error, e:
+            raise CodeProviderException('Cannot start verification code webhook: %s' % e)
+
+    raise CodeProviderException('Invalid verification code source: %s' % source)
@@ -0,0 +1,207 @@
+import os
+import json
+import socket
+import logging
+import threading
+import SocketServer
+
+from job import Job, JobException
+from log_pipeline import JobLog, JobLogFilter
+from code_providers import CodeProviderException, CallbackCodeProvider, create_code_provider
+
+logger = logging.getLogger('WhatsDump')
+
+
+class StreamHandler(logging.Handler):
+    """Forwards job log records to the connected client"""
+
+    def __init__(self, channel):
+        logging.Handler.__init__(self)
+        self.channel = channel
+
+    def emit(self, record):
+        try:
+            self.channel.send({'type': 'log', 'level': record.levelname, 'message': self.format(record)})
+        except socket.error:
+            pass
+
+
+class Channel:
+    """Newline-delimited JSON messages over a stream socket"""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._rfile = sock.makefile('rb')
+        self._lock = threading.Lock()
+
+    def send(self, message):
+        data = json.dumps(message) + '\n'
+
+        with self._lock:
+            self._sock.sendall(data)
+
+    def receive(self):
+        line = self._rfile.readline()
+
+        if not line:
+            return None
+
+        return json.loads(line)
+
+    def close(self):
+        self._rfile.close()
+        self._sock.close()
+
+
+class JobRequestHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        channel = Channel(self.request)
+
+        try:
+            message = channel.receive()
+
+            if not message:
+                return
+
+            if message['type'] == 'job':
+                self._handle_job(channel, message)
+            elif message['type'] == 'status':
+                channel.send({'type': 'status', 'pool': self.server.pool.status()})
+            elif message['type'] == 'shutdown':
+                channel.send({'type': 'result', 'ok': True})
+                threading.Thread(target=self.server.shutdown).start()
+            else:
+                channel.send({'type': 'error', 'reason': 'Unknown request type: %s' % message['type']})
+        except (ValueError, KeyError):
+            channel.send({'type': 'error', 'reason': 'Malformed request'})
+
+    def _handle_job(self, channel, message):
+        source_device = None
+
+        if message.get('serial'):
+            source_device = self.server.adb_client.device(message['serial'])
+
+            if not source_device:
+                channel.send({'type': 'error', 'reason': 'Device %s not connected' % message['serial']})
+                return
+
+        job = Job.from_message(message, source_device)
+
+        # Route job log records to the job log file and to the client, including records of
+        # thread pools the job propagates its log to (e.g. msgstore push progress)
+        job_log = JobLog(os.path.join(job.dst_path, 'log.txt'), phone=str(job.phone_no))
+        job_log.bind()
+
+        stream_handler = StreamHandler(channel)
+        stream_handler.addFilter(JobLogFilter(job_log))
+        stream_handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(stream_handler)
+        code_provider = None
+
+        try:
+            # Creates directory of job log file
+            job.prepare()
+
+            # Unattended jobs get their codes from a local provider, otherwise ask client
+            if message.get('code_source'):
+                code_provider = create_code_provider(message['code_source'], message.get('code_timeout'))
+            else:
+                code_provider = CallbackCodeProvider(lambda: self._ask_code(channel))
+
+            key_path = job.execute(self.server.pool, code_provider, message)
+
+            channel.send({'type': 'result', 'ok': True, 'key': key_path})
+        except (JobException, CodeProviderException), e:
+            channel.send({'type': 'error', 'reason': e.reason})
+        finally:
+            logger.removeHandler(stream_handler)
+
+            if code_provider:
+                code_provider.close()
+
+            job_log.unbind()
+
+    def _ask_code(self, channel):
+        channel.send({'type': 'code_request'})
+        reply = channel.receive()
+
+        if not reply:
+            raise CodeProviderException('Client disconnected while waiting for verification code')
+
+        return reply.get('code')
+
+
+class DaemonServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, adb_client, pool):
+        self.adb_client = adb_client
+        self.pool = pool
+
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+        SocketServer.UnixStreamServer.__init__(self, socket_path, JobRequestHandler)
+
+
+class DaemonClient:
+    def __init__(self, socket_path):
+        self._socket_path = socket_path
+
+    def is_running(self):
+        try:
+            self._connect().close()
+        except socket.error:
+            return False
+
+        return True
+
+    def submit(self, request, code_provider):
+        """Runs job request (see Job.from_message and Job.execute) and streams its logs, returns key path"""
+        channel = self._connect()
+
+        try:
+            channel.send(dict(request, type='job'))
+
+            while True:
+                message = channel.receive()
+
+                if message is None:
+                    raise JobException('Daemon closed connection')
+
+                if message['type'] == 'log':
+                    logger.log(logging.getLevelName(message['level']), '%s', message['message'])
+                elif message['type'] == 'code_request':
+                    try:
+                        code = code_provider.get_code()
+                    except CodeProviderException, e:
+                        raise JobException(e.reason)
+
+                    channel.send({'type': 'code', 'code': code})
+                elif message['type'] == 'result':
+                    return message['key']
+                elif message['type'] == 'error':
+                    raise JobException(message['reason'])
+        finally:
+            channel.close()
+
+    def status(self):
+        return self._request({'type': 'status'})
+
+    def shutdown(self):
+        return self._request({'type': 'shutdown'})
+
+    def _request(self, message):
+        channel = self._connect()
+
+        try:
+            channel.send(message)
+            return channel.receive()
+        finally:
+            channel.close()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(self._socket_path)
+
+        return Channel(sock)
@@ -0,0 +1,99 @@
+import logging
+import threading
+import Queue
+
+logger = logging.getLogger('WhatsDump')
+
+
+class EmulatorPool:
+    BASE_PORT = 5554
+
+    def __init__(self, sdk, adb_client, size=1, show_screen=False, no_accel=False, profile=None, base_port=BASE_PORT):
+        self._sdk = sdk
+        self._adb_client = adb_client
+        self._size = size
+        self._base_port = base_port
+        self._show_screen = show_screen
+        self._no_accel = no_accel
+        self._profile = profile
+        self._idle = Queue.Queue()
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        # Boot all instances up front so jobs do not pay for boot time
+        port = self._base_port - 2
+
+        for i in range(self._size):
+            # Skip ports of emulators run by other processes (another daemon/worker on this host)
+            port = self._sdk.find_free_port(self._adb_client, port + 2)
+
+            if not port:
+                logger.error('No free emulator port left from %d', self._base_port)
+                break
+
+            if not self._boot(port):
+                logger.error('Could not start pool emulator on port %d', port)
+
+        return len(self._devices) > 0
+
+    def acquire(self, timeout=None):
+        try:
+            return self._idle.get(timeout=timeout)
+        except Queue.Empty:
+            return None
+
+    def release(self, device):
+        # Reset instance, boot a new one if it is not usable anymore
+        if self._reset(device):
+            self._idle.put(device)
+            return
+
+        logger.warning('Could not reset emulator %s, rebooting it', device.serial)
+
+        port = self._devices.get(device.serial)
+        self._stop(device.serial)
+
+        if port:
+            self._boot(port)
+
+    def stop(self):
+        for serial in list(self._devices):
+            self._stop(serial)
+
+    def status(self):
+        return {
+            'size': self._size,
+            'running': len(self._devices),
+            'idle': self._idle.qsize()
+        }
+
+    def _boot(self, port):
+        logger.info('Booting pool emulator on port %d...', port)
+
+        device = self._sdk.start_emulator(self._adb_client, self._show_screen, self._no_accel,
+                                          port=port, read_only=True, profile=self._profile)
+
+        if not device:
+            return False
+
+        with self._lock:
+            self._devices[device.serial] = port
+
+        self._idle.put(device)
+        return True
+
+    def _stop(self, serial):
+        with self._lock:
+            self._devices.pop(serial, None)
+
+        self._sdk.stop_emulator(self._adb_client, serial)
+
+    def _reset(self, device):
+        try:
+            device.shell('pm uninstall com.whatsapp')
+            device.shell('rm -rf /sdcard/WhatsApp')
+
+            return not device.is_installed('com.whatsapp')
+        except RuntimeError:
+            return False
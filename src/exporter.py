@@ -0,0 +1,175 @@
+import os
+import time
+import itertools
+import csv
+import gzip
+import json
+import logging
+import tempfile
+
+from msgstore import MsgstoreReader
+
+logger = logging.getLogger('WhatsDump')
+
+
+class _JsonlWriter:
+    def __init__(self, f, fields):
+        self._f = f
+
+    def write(self, record):
+        self._f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + '\n')
+
+
+class _CsvWriter:
+    def __init__(self, f, fields):
+        self._fields = fields
+        self._writer = csv.writer(f)
+        self._writer.writerow(fields)
+
+    def write(self, record):
+        self._writer.writerow([self._encode(record[field]) for field in self._fields])
+
+    def _encode(self, value):
+        # Python 2 csv module only handles byte strings
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+
+        return value
+
+
+class ExportState:
+    """Per-phone export high-water mark"""
+
+    def __init__(self, last_id=0, anchors=None, last_timestamp=0, last_jid_id=0, edit_timestamp=0, chats=None,
+                 last_key_id=None):
+        self.last_id = last_id
+        # State files of older versions only stored key of last message
+        self.anchors = anchors or ([[last_id, last_key_id]] if last_key_id else [])
+        self.last_timestamp = last_timestamp
+        self.last_jid_id = last_jid_id
+        self.edit_timestamp = edit_timestamp
+        self.chats = set(chats or [])
+
+    @classmethod
+    def load(cls, path):
+        if not os.path.isfile(path):
+            return cls()
+
+        with open(path, 'rb') as f:
+            return cls(**json.load(f))
+
+    def save(self, path):
+        data = dict(self.__dict__, chats=sorted(self.chats))
+
+        with open(path + '.tmp', 'wb') as f:
+            json.dump(data, f)
+
+        if os.path.exists(path):
+            os.remove(path)
+
+        os.rename(path + '.tmp', path)
+
+    def track(self, messages):
+        for message in messages:
+            self.last_timestamp = max(self.last_timestamp, message['timestamp'] or 0)
+            yield message
+
+
+class MsgstoreExporter:
+    FORMATS = {
+        'jsonl': _JsonlWriter,
+        'csv': _CsvWriter
+    }
+
+    CHAT_FIELDS = ('id', 'jid', 'subject')
+    CONTACT_FIELDS = ('id', 'jid', 'type')
+
+    def __init__(self, db_path, dst_path, fmt='jsonl', compress=True, batch_size=5000):
+        if fmt not in self.FORMATS:
+            raise ValueError('Unknown export format: %s' % fmt)
+
+        self.db_path = db_path
+        self.dst_path = dst_path
+        self.fmt = fmt
+        self.compress = compress
+        self.batch_size = batch_size
+
+    def export(self, state_path=None):
+        """Writes chats, contacts and messages files in a single streaming pass each, returns messages count
+
+        With state_path (incremental mode) only messages, chats and contacts added or edited since
+        the high-water mark stored there are exported, into a new directory named after time and id range.
+        """
+        reader = MsgstoreReader(self.db_path, self.batch_size)
+        dst_path = self.dst_path
+
+        try:
+            state = ExportState.load(state_path) if state_path else ExportState()
+            max_id = reader.max_message_id()
+
+            # Message ids are only comparable while the device keeps the same database
+            if state.last_id and not reader.matches_anchors(state.anchors):
+                logger.warning('Msgstore does not match previous export high-water mark, exporting everything')
+                state = ExportState()
+
+            if not os.path.exists(self.dst_path):
+                os.makedirs(self.dst_path)
+
+            if state_path:
+                # Unique even for exports started within the same second
+                dst_path = tempfile.mkdtemp(prefix='%s-%d-%d-' % (time.strftime('%Y%m%d-%H%M%S'), state.last_id,
+                                                                  max_id), dir=self.dst_path)
+                logger.info('Incremental export of messages after #%d (up to #%d)', state.last_id, max_id)
+
+            logger.info('Exporting msgstore (%s schema) to %s...', reader.schema, dst_path)
+
+            # Full export: messages are written with their current text, earlier edits are already included
+            if state.last_id:
+                edited_ids = reader.edited_message_ids(state.edit_timestamp, state.last_id)[0]
+            else:
+                edited_ids = []
+            new_chats = [chat for chat in reader.chats() if chat['id'] not in state.chats]
+            messages = itertools.chain(reader.messages(state.last_id, max_id), reader.messages_by_ids(edited_ids))
+
+            self._write(dst_path, 'chats', self.CHAT_FIELDS, new_chats)
+            self._write(dst_path, 'contacts', self.CONTACT_FIELDS, reader.contacts(state.last_jid_id, state.last_id))
+            count = self._write(dst_path, 'messages', MsgstoreReader.MESSAGE_FIELDS, state.track(messages))
+
+            state.last_id = max_id
+            state.anchors = reader.anchors(max_id)
+            state.last_jid_id = reader.max_jid_id()
+            # New messages were exported with their current text too: skip every edit seen so far
+            state.edit_timestamp = max(state.edit_timestamp, reader.max_edit_timestamp())
+            state.chats.update(chat['id'] for chat in new_chats)
+        finally:
+            reader.close()
+
+        if state_path:
+            state.save(state_path)
+
+        logger.info('Exported %d messages (%d edited)', count, len(edited_ids))
+
+        return count
+
+    def _write(self, dst_path, name, fields, records):
+        path = os.path.join(dst_path, '%s.%s' % (name, self.fmt))
+        count = 0
+
+        # Write to temporary file first: readers never see partial exports
+        tmp_path = path + ('.gz' if self.compress else '') + '.tmp'
+
+        with (gzip.open(tmp_path, 'wb') if self.compress else open(tmp_path, 'wb')) as f:
+            writer = self.FORMATS[self.fmt](f, fields)
+
+            for record in records:
+                writer.write(record)
+                count += 1
+
+        final_path = tmp_path[:-len('.tmp')]
+
+        if os.path.exists(final_path):
+            os.remove(final_path)
+
+        os.rename(tmp_path, final_path)
+
+        return count
@@ -0,0 +1,134 @@
+import re
+import logging
+
+from pipes import quote
+from xml.etree import cElementTree as ElementTree
+
+logger = logging.getLogger('WhatsDump')
+
+
+class LeanView:
+    BOUNDS_RE = re.compile(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]')
+
+    def __init__(self, adb_client, resource_id, text, bounds):
+        self.adb_client = adb_client
+        self.resource_id = resource_id
+        self.text = text
+        self.bounds = bounds
+
+    def getText(self):
+        return self.text
+
+    def getCenter(self):
+        m = self.BOUNDS_RE.match(self.bounds)
+
+        if not m:
+            raise RuntimeError('Malformed view bounds: %s' % self.bounds)
+
+        x1, y1, x2, y2 = [int(v) for v in m.groups()]
+
+        return (x1 + x2) / 2, (y1 + y2) / 2
+
+    def touch(self):
+        self.adb_client.shell('input tap %d %d' % self.getCenter())
+
+    def setText(self, text):
+        # Focus field, move cursor to end and delete current content
+        self.touch()
+
+        if self.text:
+            self.adb_client.shell('input keyevent KEYCODE_MOVE_END' + ' KEYCODE_DEL' * len(self.text))
+
+        # "input text" uses %s for spaces
+        self.adb_client.shell('input text %s' % quote(text.replace(' ', '%s')))
+        self.text = text
+
+    def __repr__(self):
+        return '%s text=%r bounds=%s' % (self.resource_id, self.text, self.bounds)
+
+
+class _IndexBuilder:
+    """XMLParser target keeping only nodes with a resource-id (first occurrence wins)"""
+
+    def __init__(self):
+        self.index = {}
+        self.depth = 0
+        self.complete = False
+
+    def start(self, tag, attrib):
+        self.depth += 1
+        resource_id = attrib.get('resource-id')
+
+        if tag == 'node' and resource_id and resource_id not in self.index:
+            self.index[resource_id] = (attrib.get('text', ''), attrib.get('bounds', ''))
+
+    def end(self, tag):
+        self.depth -= 1
+
+        if self.depth == 0:
+            self.complete = True
+
+    def data(self, data):
+        pass
+
+    def close(self):
+        return self.index
+
+
+class LeanViewClient:
+    """Minimal ViewClient replacement: streams "uiautomator dump" output into a resource-id index
+
+    Implements only what WhatsApp automation needs (dump, findViewById, traverse).
+    """
+
+    DUMP_CMD = 'uiautomator dump /dev/tty'
+    CHUNK_SIZE = 16384
+
+    def __init__(self, adb_client):
+        self.adb_client = adb_client
+        self._index = {}
+
+    def dump(self, sleep=0):
+        builder = _IndexBuilder()
+        parser = ElementTree.XMLParser(target=builder)
+
+        def handler(conn):
+            try:
+                while not builder.complete:
+                    chunk = conn.read(self.CHUNK_SIZE)
+
+                    if not chunk:
+                        break
+
+                    # Hierarchy is followed by "UI hierchary dumped to: /dev/tty"
+                    try:
+                        parser.feed(chunk)
+                    except SyntaxError:
+                        if not builder.complete:
+                            raise
+            finally:
+                conn.close()
+
+        try:
+            self.adb_client.shell(self.DUMP_CMD, handler=handler)
+        except SyntaxError, e:
+            raise RuntimeError('Could not parse UI hierarchy: %s' % e)
+
+        if not builder.complete:
+            raise RuntimeError('Could not dump UI hierarchy')
+
+        self._index = builder.index
+
+        return self._index
+
+    def findViewById(self, view_id):
+        node = self._index.get(view_id)
+
+        if not node:
+            return None
+
+        return LeanView(self.adb_client, view_id, node[0], node[1])
+
+    def traverse(self):
+        for view_id in sorted(self._index):
+            logger.debug('%s', self.findViewById(view_id))
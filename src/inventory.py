@@ -0,0 +1,79 @@
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+logger = logging.getLogger('WhatsDump')
+
+
+class DeviceInfo:
+    def __init__(self, serial, name='', model='', android='', wa_installed=False, databases=None, error=None):
+        self.serial = serial
+        self.name = name
+        self.model = model
+        self.android = android
+        self.wa_installed = wa_installed
+        self.databases = databases or {}
+        self.error = error
+
+    @property
+    def databases_size(self):
+        return sum(self.databases.values())
+
+
+class DeviceInventory:
+    # Single shell round-trip per device, sections separated by markers
+    QUERY = ('getprop ro.product.name; getprop ro.product.model; getprop ro.build.version.release; '
+             'echo @@; pm path com.whatsapp; '
+             'echo @@; ls -ln $EXTERNAL_STORAGE/WhatsApp/Databases/ 2>/dev/null')
+
+    def __init__(self, workers=8):
+        self._workers = workers
+
+    def scan(self, devices):
+        """Queries all devices concurrently, returns DeviceInfo list in the same order"""
+        if not devices:
+            return []
+
+        pool = ThreadPool(min(self._workers, len(devices)))
+
+        try:
+            return pool.map(self._query, devices)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _query(self, device):
+        try:
+            output = device.shell(self.QUERY)
+        except RuntimeError, e:
+            logger.debug('Inventory query failed for %s: %s', device.serial, e)
+            return DeviceInfo(device.serial, error=str(e))
+
+        sections = output.split('@@')
+
+        if len(sections) != 3:
+            return DeviceInfo(device.serial, error='Unexpected inventory output')
+
+        props = [line.strip() for line in sections[0].strip().splitlines()]
+        props += [''] * (3 - len(props))
+
+        return DeviceInfo(device.serial, name=props[0], model=props[1], android=props[2],
+                          wa_installed='package:' in sections[1],
+                          databases=self._parse_databases(sections[2]))
+
+    def _parse_databases(self, listing):
+        databases = {}
+
+        for line in listing.splitlines():
+            fields = line.split()
+
+            # toolbox and toybox ls -l both place size 4th from the end (before date, time and name)
+            if len(fields) < 7 or not fields[0].startswith('-') or not fields[-1].startswith('msgstore'):
+                continue
+
+            try:
+                databases[fields[-1]] = int(fields[-4])
+            except ValueError:
+                continue
+
+        return databases
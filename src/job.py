@@ -0,0 +1,252 @@
+import os
+import glob
+import shutil
+import logging
+import sqlite3
+import threading
+
+from utils import sha256
+from whatsapp import WhatsApp, WaException
+from msgcrypt import decrypt_msgstore, is_sqlite, CryptException
+from msgstore import MsgstoreException
+from exporter import MsgstoreExporter
+from merge import merge_msgstores
+from search import SearchIndex
+from store import BlobStore
+
+logger = logging.getLogger('WhatsDump')
+
+
+class JobException:
+    def __init__(self, reason, retry=False):
+        self.reason = reason
+        # Failed before WhatsApp was asked for a verification code: running the job again is harmless
+        self.retry = retry
+
+
+class Job:
+    def __init__(self, country_code, phone_no, verify_method, msgstore_path=None, source_device=None,
+                 output_dir='output', ui_backend='lean'):
+        self.country_code = country_code
+        self.phone_no = phone_no
+        self.verify_method = verify_method
+        self.msgstore_path = msgstore_path
+        self.source_device = source_device
+        self.ui_backend = ui_backend
+        self.backup_paths = []
+        self.db_path = None
+        self.key_path = None
+        self.verification_requested = False
+        self.dst_path = os.path.join(os.path.abspath(output_dir), str(phone_no))
+
+        self._aborted = threading.Event()
+
+    @classmethod
+    def from_message(cls, message, source_device=None):
+        """Job from daemon/job table request (dict)"""
+        return cls(message['country_code'], message['phone'], message['verify'], msgstore_path=message.get('msgstore'),
+                   source_device=source_device, ui_backend=message.get('ui_backend', 'lean'))
+
+    def abort(self):
+        """Stops execute() before its next stage (the running one is not interrupted)"""
+        self._aborted.set()
+
+    def check_aborted(self):
+        if self._aborted.is_set():
+            raise JobException('Job aborted')
+
+    def prepare(self):
+        # create phone directory tree where to store results
+        if not os.path.exists(self.dst_path):
+            try:
+                os.makedirs(self.dst_path)
+            except OSError:
+                raise JobException('Cannot create output directory tree')
+
+    def extract_msgstore(self, all_backups=False):
+        if self.msgstore_path:
+            logger.info('Provided msgstore.db SHA-256 hash: %s', sha256(self.msgstore_path))
+
+            # Older backups lying next to provided msgstore, most recent first
+            if all_backups:
+                backups_dir = os.path.dirname(os.path.abspath(self.msgstore_path))
+                self.backup_paths = sorted(glob.glob(os.path.join(backups_dir, 'msgstore*.crypt12')),
+                                           key=os.path.getmtime, reverse=True)
+
+        if self.source_device:
+            logger.info('Extracting msgstore.db.crypt from phone to output/%ld/ ...' % self.phone_no)
+
+            wa = WhatsApp(self.source_device)
+
+            if all_backups:
+                self.backup_paths = wa.extract_msgstore_backups(self.dst_path)
+                self.msgstore_path = self.backup_paths[0] if self.backup_paths else None
+            else:
+                self.msgstore_path = wa.extract_msgstore(self.dst_path)
+
+            if not self.msgstore_path:
+                raise JobException('Could not find/extract msgstore database from device (is WhatsApp installed?)')
+
+            logger.info('Extracted msgstore.db SHA-256 hash: %s', sha256(self.msgstore_path))
+
+        if self.backup_paths:
+            # Registration always uses the given/most recent database
+            if os.path.abspath(self.msgstore_path) in self.backup_paths:
+                self.backup_paths.remove(os.path.abspath(self.msgstore_path))
+
+            self.backup_paths.insert(0, os.path.abspath(self.msgstore_path))
+            logger.info('Found %d msgstore backup(s) to merge', len(self.backup_paths))
+
+    def run(self, emulator_device, code_provider):
+        logger.info('Trying to register phone on emulator... (may take few minutes)')
+
+        # Attempt to register phone using provided msgstore
+        wa_emu = WhatsApp(emulator_device, self.ui_backend)
+
+        try:
+            wa_emu.register_phone(self.msgstore_path, self.country_code, self.phone_no, self.verify_method,
+                                  code_provider)
+        except WaException, e:
+            raise JobException('Exception in verification: %s' % e.reason, retry=not wa_emu.verification_requested)
+        finally:
+            self.verification_requested = wa_emu.verification_requested
+
+        logger.info('Phone registered successfully!')
+        logger.info('Extracting key...')
+
+        # Extract private key
+        if not wa_emu.extract_priv_key(self.dst_path):
+            raise JobException('Could not extract private key!')
+
+        self.key_path = os.path.join(self.dst_path, 'key')
+        logger.info('Private key extracted in %s', self.key_path)
+
+        return self.key_path
+
+    def decrypt(self):
+        """Returns path of plain msgstore.db, decrypting it with extracted key if needed"""
+        if self.db_path:
+            return self.db_path
+
+        if is_sqlite(self.msgstore_path):
+            self.db_path = self.msgstore_path
+            return self.db_path
+
+        db_path = os.path.join(self.dst_path, 'msgstore.db')
+        logger.info('Decrypting msgstore into %s...', db_path)
+
+        try:
+            self.db_path = decrypt_msgstore(os.path.join(self.dst_path, 'key'), self.msgstore_path, db_path)
+        except CryptException, e:
+            raise JobException(e.reason)
+
+        return self.db_path
+
+    def merge_backups(self):
+        """Decrypts all backups and merges them into output/<phone>/msgstore.db"""
+        if len(self.backup_paths) < 2:
+            logger.info('No older msgstore backups to merge')
+            return self.decrypt()
+
+        tmp_dir = os.path.join(self.dst_path, 'backups')
+        key_path = os.path.join(self.dst_path, 'key')
+        db_paths = []
+
+        if not os.path.exists(tmp_dir):
+            os.makedirs(tmp_dir)
+
+        try:
+            for backup_path in self.backup_paths:
+                if is_sqlite(backup_path):
+                    db_paths.append(backup_path)
+                    continue
+
+                logger.info('Decrypting msgstore backup %s...', os.path.basename(backup_path))
+                db_path = os.path.join(tmp_dir, os.path.basename(backup_path) + '.db')
+
+                try:
+                    db_paths.append(decrypt_msgstore(key_path, backup_path, db_path))
+                except CryptException, e:
+                    logger.warning('Skipping backup: %s', e.reason)
+
+            if not db_paths:
+                raise JobException('Could not decrypt any msgstore backup')
+
+            self.db_path = os.path.join(self.dst_path, 'msgstore.db')
+            merge_msgstores(db_paths, self.db_path)
+        except MsgstoreException, e:
+            raise JobException(e.reason)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        return self.db_path
+
+    def export(self, fmt, compress=True, incremental=False):
+        db_path = self.decrypt()
+        exporter = MsgstoreExporter(db_path, os.path.join(self.dst_path, 'export'), fmt, compress)
+        state_path = os.path.join(self.dst_path, 'export_state.json') if incremental else None
+
+        try:
+            return exporter.export(state_path)
+        except MsgstoreException, e:
+            raise JobException(e.reason)
+        except sqlite3.Error, e:
+            raise JobException('Could not export msgstore: %s' % e)
+
+    def index(self, index_path):
+        db_path = self.decrypt()
+
+        try:
+            search_index = SearchIndex(index_path)
+
+            try:
+                return search_index.update(self.phone_no, db_path)
+            finally:
+                search_index.close()
+        except MsgstoreException, e:
+            raise JobException(e.reason)
+        except sqlite3.Error, e:
+            raise JobException('Could not update search index: %s' % e)
+
+    def store(self, compress=False):
+        """Moves run files into the content-addressed store under output/.store/"""
+        if not BlobStore.is_supported():
+            logger.warning('Hardlinks not supported on this platform, output files are not deduplicated')
+            return None
+
+        try:
+            return BlobStore(os.path.join(os.path.dirname(self.dst_path), '.store'), compress).commit_run(
+                self.phone_no, self.dst_path)
+        except (OSError, IOError), e:
+            raise JobException('Could not store output files: %s' % e)
+
+    def execute(self, pool, code_provider, options):
+        """Whole pipeline on an emulator of pool, steps enabled by options (daemon/job table request)"""
+        self.extract_msgstore(options.get('merge_backups', False))
+
+        logger.info('Waiting for an idle emulator...')
+        emulator_device = pool.acquire()
+
+        try:
+            self.check_aborted()
+            key_path = self.run(emulator_device, code_provider)
+        finally:
+            pool.release(emulator_device)
+
+        if options.get('merge_backups'):
+            self.check_aborted()
+            self.merge_backups()
+
+        if options.get('export'):
+            self.check_aborted()
+            self.export(options['export'], options.get('export_compress', True), options.get('export_incremental', False))
+
+        if options.get('search_index'):
+            self.check_aborted()
+            self.index(options['search_index'])
+
+        if options.get('store', True):
+            self.check_aborted()
+            self.store(options.get('store_compress', False))
+
+        return key_path
@@ -0,0 +1,207 @@
+import json
+import time
+import sqlite3
+import threading
+
+
+class JobTableException:
+    def __init__(self, reason):
+        self.reason = reason
+
+
+class JobTable:
+    """Shared queue of jobs claimed by workers through expiring leases
+
+    A worker owns a job while it keeps renewing the lease with heartbeat(); jobs whose lease
+    expired (crashed/partitioned worker) are handed to the next claim().
+    """
+
+    PENDING = 'pending'
+    LEASED = 'leased'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def submit(self, payload, max_attempts=3):
+        raise NotImplementedError
+
+    def claim(self, worker_id, lease_seconds):
+        """Returns (job_id, payload) or None"""
+        raise NotImplementedError
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        """Renews lease, returns False if the job is not owned by worker anymore"""
+        raise NotImplementedError
+
+    def complete(self, job_id, worker_id, result):
+        raise NotImplementedError
+
+    def fail(self, job_id, worker_id, reason, retry=True):
+        """Job goes back to pending while it has attempts left (and retry is set), failed otherwise"""
+        raise NotImplementedError
+
+    def register_worker(self, worker_id, host, capacity, busy):
+        raise NotImplementedError
+
+    def jobs(self, state=None):
+        raise NotImplementedError
+
+    def workers(self):
+        raise NotImplementedError
+
+
+class SqliteJobTable(JobTable):
+    """SQLite job table, usable by several processes/hosts sharing the database file
+
+    Rollback journal (not WAL) and BEGIN IMMEDIATE transactions: safe with plain file locking,
+    as available on most shared filesystems.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, '
+        'state TEXT NOT NULL, worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, '
+        'max_attempts INTEGER NOT NULL, result TEXT, created REAL NOT NULL, updated REAL NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires)',
+        'CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, host TEXT, capacity INTEGER, busy INTEGER, '
+        'last_seen REAL)'
+    ]
+
+    def __init__(self, path, timeout=60):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self._transaction() as conn:
+            for sql in self.SCHEMA:
+                conn.execute(sql)
+
+    def submit(self, payload, max_attempts=3):
+        now = time.time()
+
+        with self._transaction() as conn:
+            cursor = conn.execute('INSERT INTO jobs (payload, state, max_attempts, created, updated) '
+                                  'VALUES (?, ?, ?, ?, ?)', (json.dumps(payload), self.PENDING, max_attempts, now, now))
+
+            return cursor.lastrowid
+
+    def claim(self, worker_id, lease_seconds):
+        now = time.time()
+
+        with self._transaction() as conn:
+            # Jobs out of attempts whose lease expired are given up
+            conn.execute('UPDATE jobs SET state = ?, result = ?, updated = ? WHERE state = ? AND lease_expires < ? '
+                         'AND attempts >= max_attempts',
+                         (self.FAILED, json.dumps({'reason': 'Lease expired too many times'}), now, self.LEASED, now))
+
+            row = conn.execute('SELECT id, payload FROM jobs WHERE state = ? OR (state = ? AND lease_expires < ?) '
+                               'ORDER BY id LIMIT 1', (self.PENDING, self.LEASED, now)).fetchone()
+
+            if not row:
+                return None
+
+            conn.execute('UPDATE jobs SET state = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, '
+                         'updated = ? WHERE id = ?', (self.LEASED, worker_id, now + lease_seconds, now, row[0]))
+
+        return row[0], json.loads(row[1])
+
+    def heartbeat(self, job_id, worker_id, lease_seconds):
+        now = time.time()
+
+        with self._transaction() as conn:
+            cursor = conn.execute('UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND worker = ? '
+                                  'AND state = ?', (now + lease_seconds, now, job_id, worker_id, self.LEASED))
+
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        return self._finish(job_id, worker_id, self.DONE, result)
+
+    def fail(self, job_id, worker_id, reason, retry=True):
+        if retry:
+            with self._transaction() as conn:
+                # Transient failures (adb, emulator, ...): hand job to next claim
+                cursor = conn.execute('UPDATE jobs SET state = ?, worker = NULL, lease_expires = NULL, result = ?, '
+                                      'updated = ? WHERE id = ? AND worker = ? AND state = ? AND attempts < max_attempts',
+                                      (self.PENDING, json.dumps({'reason': reason}), time.time(), job_id, worker_id,
+                                       self.LEASED))
+
+                if cursor.rowcount == 1:
+                    return True
+
+        return self._finish(job_id, worker_id, self.FAILED, {'reason': reason})
+
+    def register_worker(self, worker_id, host, capacity, busy):
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO workers (id, host, capacity, busy, last_seen) VALUES (?, ?, ?, ?, ?)',
+                         (worker_id, host, capacity, busy, time.time()))
+
+    def jobs(self, state=None):
+        sql = 'SELECT id, state, worker, attempts, payload, result FROM jobs'
+        params = ()
+
+        if state:
+            sql += ' WHERE state = ?'
+            params = (state,)
+
+        for row in self._connection().execute(sql + ' ORDER BY id', params):
+            yield {'id': row[0], 'state': row[1], 'worker': row[2], 'attempts': row[3],
+                   'payload': json.loads(row[4]), 'result': json.loads(row[5]) if row[5] else None}
+
+    def workers(self):
+        for row in self._connection().execute('SELECT id, host, capacity, busy, last_seen FROM workers ORDER BY id'):
+            yield dict(zip(('id', 'host', 'capacity', 'busy', 'last_seen'), row))
+
+    def _finish(self, job_id, worker_id, state, result):
+        with self._transaction() as conn:
+            cursor = conn.execute('UPDATE jobs SET state = ?, result = ?, lease_expires = NULL, updated = ? '
+                                  'WHERE id = ? AND worker = ? AND state = ?',
+                                  (state, json.dumps(result), time.time(), job_id, worker_id, self.LEASED))
+
+            return cursor.rowcount == 1
+
+    def _connection(self):
+        # sqlite3 connections can not be shared between threads
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            self._local.conn.execute('PRAGMA journal_mode = DELETE')
+
+        return self._local.conn
+
+    def _transaction(self):
+        return _Transaction(self._connection())
+
+
+class _Transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        try:
+            self.conn.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error, e:
+            raise JobTableException('Could not lock job table: %s' % e)
+
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.conn.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+def open_job_table(location):
+    """Job table backend from location: 'sqlite:<path>' or plain path (SQLite)"""
+    kind, sep, value = location.partition(':')
+
+    if sep and kind == 'sqlite':
+        location = value
+
+    # SQLite would open a private temporary database, never seen by workers
+    if not location:
+        raise JobTableException('Missing job table database path')
+
+    if sep and kind == 'sqlite':
+        return SqliteJobTable(location)
+
+    # Single letter: Windows drive, not a backend
+    if sep and len(kind) > 1 and '/' not in kind and '\\' not in kind:
+        raise JobTableException('Unknown job table backend: %s' % kind)
+
+    return SqliteJobTable(location)
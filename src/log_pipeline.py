@@ -0,0 +1,206 @@
+import sys
+import json
+import time
+import Queue
+import atexit
+import logging
+import threading
+
+_context = threading.local()
+_handler = None
+
+_STOP = object()
+
+
+class JobLog:
+    """Routes log records of the current thread to a job log file (JSON lines), with extra fields
+
+    Usage: bind() in the thread running the job, unbind() when done (or as context manager).
+    """
+
+    def __init__(self, log_path, **fields):
+        self.log_path = log_path
+        self.fields = fields
+        self._previous = None
+
+    def bind(self):
+        self._previous = getattr(_context, 'job_log', None)
+        _context.job_log = self
+
+    def unbind(self):
+        _context.job_log = self._previous
+
+        if _handler:
+            _handler.close_route(self.log_path)
+
+    def __enter__(self):
+        self.bind()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.unbind()
+
+
+def current_job_log():
+    return getattr(_context, 'job_log', None)
+
+
+class JobLogFilter(logging.Filter):
+    """Accepts only records of the given job: its thread and thread pools it propagated its JobLog to"""
+
+    def __init__(self, job_log):
+        logging.Filter.__init__(self)
+        self.job_log = job_log
+
+    def filter(self, record):
+        # Called in the emitting thread
+        return current_job_log() is self.job_log
+
+
+def propagate(func):
+    """Wraps func so it logs to the job log of the calling thread (for thread pools inside a job)"""
+    job_log = current_job_log()
+
+    def wrapper(*args, **kwargs):
+        previous = current_job_log()
+        _context.job_log = job_log
+
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _context.job_log = previous
+
+    return wrapper
+
+
+class QueueLogHandler(logging.Handler):
+    """Queues records of threads bound to a JobLog; a background thread writes them
+
+    Emitting never touches the disk: slow storage does not stall UI polling. When the queue
+    is full, records are dropped and their count is written to the job log when it is closed.
+    """
+
+    def __init__(self, max_queue=10000, batch_size=512, flush_interval=1.0):
+        logging.Handler.__init__(self)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue = Queue.Queue(max_queue)
+        self._dropped = {}
+        self._files = {}
+        self._thread = threading.Thread(target=self._write_loop, name='LogWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def emit(self, record):
+        job_log = current_job_log()
+
+        if not job_log:
+            return
+
+        try:
+            message = record.getMessage()
+
+            if isinstance(message, str):
+                message = message.decode('utf-8', 'replace')
+
+            entry = dict(job_log.fields, time=record.created, level=record.levelname, thread=record.threadName,
+                         message=message)
+
+            if record.exc_info:
+                entry['exception'] = logging.Formatter().formatException(record.exc_info)
+        except Exception:
+            self.handleError(record)
+            return
+
+        try:
+            self._queue.put_nowait((job_log.log_path, entry))
+        except Queue.Full:
+            with self.lock:
+                self._dropped[job_log.log_path] = self._dropped.get(job_log.log_path, 0) + 1
+
+    def close_route(self, log_path):
+        with self.lock:
+            dropped = self._dropped.pop(log_path, 0)
+
+        self._queue.put((log_path, dropped, None))
+
+    def close(self):
+        # Writes every queued record before returning
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(30)
+
+        logging.Handler.close(self)
+
+    def _write_loop(self):
+        last_flush = time.time()
+        dirty = set()
+
+        while True:
+            batch = [self._queue.get()]
+
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                pass
+
+            for item in batch:
+                if item is _STOP:
+                    self._close_files()
+                    return
+
+                if len(item) == 3:
+                    self._close_file(item[0], item[1])
+                    dirty.discard(item[0])
+                else:
+                    self._write(item[0], item[1])
+                    dirty.add(item[0])
+
+            # Flush when idle or every flush_interval under load, not after each record
+            if dirty and (self._queue.empty() or time.time() - last_flush >= self.flush_interval):
+                for log_path in dirty:
+                    if log_path in self._files:
+                        self._files[log_path].flush()
+
+                dirty.clear()
+                last_flush = time.time()
+
+    def _write(self, log_path, entry):
+        f = self._files.get(log_path)
+
+        try:
+            if not f:
+                f = self._files[log_path] = open(log_path, 'ab')
+
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+        except Exception, e:
+            # Any failure (disk, unserializable field) only loses this record, never the writer thread
+            sys.stderr.write('Could not write log record to %s: %s\n' % (log_path, e))
+
+    def _close_file(self, log_path, dropped):
+        if dropped:
+            self._write(log_path, {'time': time.time(), 'level': 'WARNING', 'thread': 'LogWriter',
+                                   'message': '%d log records dropped (logging queue full)' % dropped})
+
+        f = self._files.pop(log_path, None)
+
+        if f:
+            f.close()
+
+    def _close_files(self):
+        for log_path in list(self._files):
+            self._close_file(log_path, 0)
+
+
+def install(logger):
+    """Adds the queue handler to logger (once), its pending records are written at exit"""
+    global _handler
+
+    if not _handler:
+        _handler = QueueLogHandler()
+        logger.addHandler(_handler)
+        atexit.register(_handler.close)
+
+    return _handler
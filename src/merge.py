@@ -0,0 +1,196 @@
+import heapq
+import shutil
+import logging
+import sqlite3
+
+from msgstore import MsgstoreReader, MsgstoreException
+from utils import remove_file
+
+logger = logging.getLogger('WhatsDump')
+
+
+class _Source:
+    """Messages of one backup, streamed in message key order: (chat JID, from_me, key_id)"""
+
+    def __init__(self, db_path, rank, batch_size):
+        self.rank = rank
+        self.reader = MsgstoreReader(db_path, batch_size)
+        self.schema = self.reader.schema
+        self.columns = [row[1] for row in self.reader.conn.execute('PRAGMA table_info(%s)' % self.table)]
+        self.jids = dict(self.reader.conn.execute('SELECT _id, raw_string FROM jid')) \
+            if self.schema == MsgstoreReader.MODERN else {}
+
+    @property
+    def table(self):
+        return 'message' if self.schema == MsgstoreReader.MODERN else 'messages'
+
+    def rows(self):
+        if self.schema == MsgstoreReader.MODERN:
+            sql = ('SELECT j.raw_string, m.from_me, m.key_id, m.* FROM message m '
+                   'JOIN chat c ON c._id = m.chat_row_id JOIN jid j ON j._id = c.jid_row_id '
+                   'ORDER BY j.raw_string, m.from_me, m.key_id')
+        else:
+            # Served by the unique (key_remote_jid, key_from_me, key_id) index
+            sql = ('SELECT key_remote_jid, key_from_me, key_id, * FROM messages '
+                   'ORDER BY key_remote_jid, key_from_me, key_id')
+
+        # Rank breaks ties: for duplicated keys the newest backup comes first
+        for row in self.reader.query(sql):
+            yield row[:3], self.rank, row[3:]
+
+    def close(self):
+        self.reader.close()
+
+
+class MsgstoreMerger:
+    """Consolidates several decrypted msgstore backups into one database
+
+    The newest backup is copied as base, then messages of all backups are k-way merged by
+    message key: messages missing in the base (deleted afterwards on the phone) are inserted.
+    Memory use only depends on the number of backups (one batch per backup), not on their size.
+    """
+
+    COMMIT_EVERY = 10000
+
+    def __init__(self, db_paths, dst_path, batch_size=5000):
+        """db_paths: decrypted backups, newest first"""
+        self.db_paths = db_paths
+        self.dst_path = dst_path
+        self.batch_size = batch_size
+
+    def merge(self):
+        remove_file(self.dst_path)
+        shutil.copyfile(self.db_paths[0], self.dst_path)
+
+        sources = []
+
+        try:
+            for rank, db_path in enumerate(self.db_paths):
+                source = _Source(db_path, rank, self.batch_size)
+
+                if sources and source.schema != sources[0].schema:
+                    logger.warning('Skipping backup %s (%s schema, newest is %s)', db_path, source.schema,
+                                   sources[0].schema)
+                    source.close()
+                    continue
+
+                sources.append(source)
+
+            return self._merge(sources)
+        finally:
+            for source in sources:
+                source.close()
+
+    def _merge(self, sources):
+        target = _Target(self.dst_path, sources[0].schema)
+        by_rank = dict((source.rank, source) for source in sources)
+        last_key = None
+        inserted = 0
+
+        try:
+            for key, rank, row in heapq.merge(*[source.rows() for source in sources]):
+                # Duplicates are adjacent; first one comes from newest backup
+                if key == last_key:
+                    continue
+
+                last_key = key
+
+                # Already in base database
+                if rank == 0:
+                    continue
+
+                target.insert(by_rank[rank], key, row)
+                inserted += 1
+
+                if inserted % self.COMMIT_EVERY == 0:
+                    target.commit()
+                    logger.debug('Recovered %d messages so far', inserted)
+
+            target.commit()
+        finally:
+            target.close()
+
+        logger.info('Merged %d backups, recovered %d messages missing from newest one', len(sources), inserted)
+
+        return inserted
+
+
+class _Target:
+    def __init__(self, db_path, schema):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.text_factory = lambda data: data.decode('utf-8', 'replace')
+        self.schema = schema
+        self.table = 'message' if schema == MsgstoreReader.MODERN else 'messages'
+        self.columns = set(row[1] for row in self.conn.execute('PRAGMA table_info(%s)' % self.table))
+        self._jids = {}
+        self._chats = {}
+        self._statements = {}
+        self._has_chat_list = 'chat_list' in self._tables()
+
+        if schema == MsgstoreReader.MODERN:
+            self._jids = dict((raw, _id) for _id, raw in self.conn.execute('SELECT _id, raw_string FROM jid'))
+            self._chats = dict(self.conn.execute('SELECT j.raw_string, c._id FROM chat c '
+                                                 'JOIN jid j ON j._id = c.jid_row_id'))
+        elif self._has_chat_list:
+            self._chats = dict((jid, None) for (jid,) in self.conn.execute('SELECT key_remote_jid FROM chat_list'))
+
+    def insert(self, source, key, row):
+        values = dict(zip(source.columns, row))
+
+        # Keep original id when still free: recovered messages get the same id on every merge, so
+        # export/index high-water marks stay valid. Ids reused by newer messages are renumbered.
+        if self.conn.execute('SELECT 1 FROM %s WHERE _id = ?' % self.table, (values.get('_id'),)).fetchone():
+            values.pop('_id', None)
+
+        if self.schema == MsgstoreReader.MODERN:
+            values['chat_row_id'] = self._chat_id(key[0])
+
+            if values.get('sender_jid_row_id'):
+                values['sender_jid_row_id'] = self._jid_id(source.jids.get(values['sender_jid_row_id']))
+        elif key[0] not in self._chats and self._has_chat_list:
+            self.conn.execute('INSERT INTO chat_list (key_remote_jid) VALUES (?)', (key[0],))
+            self._chats[key[0]] = None
+
+        # Columns missing in target version are dropped
+        columns = tuple(sorted(column for column in values if column in self.columns))
+
+        if columns not in self._statements:
+            self._statements[columns] = 'INSERT OR IGNORE INTO %s (%s) VALUES (%s)' % (
+                self.table, ', '.join(columns), ', '.join('?' * len(columns)))
+
+        self.conn.execute(self._statements[columns], [values[column] for column in columns])
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _tables(self):
+        return set(row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+
+    def _jid_id(self, raw_string):
+        if raw_string is None:
+            return None
+
+        if raw_string not in self._jids:
+            user, _, server = raw_string.partition('@')
+            cursor = self.conn.execute('INSERT INTO jid (user, server, raw_string) VALUES (?, ?, ?)',
+                                       (user, server, raw_string))
+            self._jids[raw_string] = cursor.lastrowid
+
+        return self._jids[raw_string]
+
+    def _chat_id(self, raw_string):
+        if raw_string not in self._chats:
+            cursor = self.conn.execute('INSERT INTO chat (jid_row_id) VALUES (?)', (self._jid_id(raw_string),))
+            self._chats[raw_string] = cursor.lastrowid
+
+        return self._chats[raw_string]
+
+
+def merge_msgstores(db_paths, dst_path, batch_size=5000):
+    try:
+        return MsgstoreMerger(db_paths, dst_path, batch_size).merge()
+    except sqlite3.Error, e:
+        raise MsgstoreException('Could not merge msgstore backups: %s' % e)
@@ -0,0 +1,81 @@
+import os
+import zlib
+import logging
+
+try:
+    from Crypto.Cipher import AES
+except ImportError:
+    AES = None
+
+logger = logging.getLogger('WhatsDump')
+
+SQLITE_HEADER = 'SQLite format 3\x00'
+
+
+class CryptException:
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def is_sqlite(path):
+    with open(path, 'rb') as f:
+        return f.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def decrypt_msgstore(key_path, crypt_path, dst_path, chunk_size=1048576):
+    """Decrypts (AES-GCM) and inflates a msgstore.db.crypt12 backup into dst_path, chunk by chunk"""
+    if AES is None:
+        raise CryptException('pycryptodome is required to decrypt msgstore (pip install pycryptodome)')
+
+    if not crypt_path.endswith('.crypt12'):
+        raise CryptException('Unsupported msgstore format: %s (only .crypt12 is supported)' % crypt_path)
+
+    with open(key_path, 'rb') as f:
+        key = f.read()[126:158]
+
+    if len(key) != 32:
+        raise CryptException('Malformed key file: %s' % key_path)
+
+    # Layout: 67 bytes header (IV at 51), ciphertext, 16 bytes GCM tag, 4 bytes trailer
+    size = os.path.getsize(crypt_path)
+    remaining = size - 67 - 20
+
+    if remaining <= 0:
+        raise CryptException('Malformed crypt12 file: %s' % crypt_path)
+
+    tmp_path = dst_path + '.tmp'
+
+    try:
+        with open(crypt_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            header = src.read(67)
+            cipher = AES.new(key, AES.MODE_GCM, nonce=header[51:67])
+            inflater = zlib.decompressobj()
+
+            try:
+                while remaining > 0:
+                    chunk = src.read(min(chunk_size, remaining))
+
+                    if not chunk:
+                        raise CryptException('Unexpected end of crypt12 file')
+
+                    remaining -= len(chunk)
+                    dst.write(inflater.decompress(cipher.decrypt(chunk)))
+
+                dst.write(inflater.flush())
+                cipher.verify(src.read(16))
+            except (ValueError, zlib.error), e:
+                raise CryptException('Could not decrypt %s (wrong key?): %s' % (crypt_path, e))
+    except:
+        # Never leave a partial database behind, whatever failed
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+        raise
+
+    # os.rename does not overwrite on Windows
+    if os.path.exists(dst_path):
+        os.remove(dst_path)
+
+    os.rename(tmp_path, dst_path)
+
+    return dst_path
@@ -0,0 +1,253 @@
+import sqlite3
+
+
+class MsgstoreException:
+    def __init__(self, reason):
+        self.reason = reason
+
+
+class MsgstoreReader:
+    """Streams chats, contacts and messages out of a decrypted msgstore.db
+
+    Handles both the legacy schema (single "messages" table keyed by JID strings)
+    and the modern one ("message" table referencing "chat" and "jid" rows).
+    """
+
+    LEGACY = 'legacy'
+    MODERN = 'modern'
+
+    MESSAGE_FIELDS = ('id', 'chat', 'chat_subject', 'from_me', 'sender', 'key_id', 'timestamp', 'status', 'type',
+                      'text', 'media_mime_type')
+
+    # Anchor messages, counted back from the high-water mark: most recent ones and a few spread out older ones
+    ANCHOR_OFFSETS = (0, 1, 2, 3, 4, 5, 6, 7, 16, 64, 256, 1024, 4096, 16384)
+
+    def __init__(self, db_path, batch_size=5000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.conn = sqlite3.connect(db_path)
+        self.conn.text_factory = lambda data: data.decode('utf-8', 'replace')
+        self.conn.execute('PRAGMA query_only = 1')
+
+        self._columns = {}
+        self._jids = None
+        self._chats = None
+
+        tables = set(row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+
+        if set(['message', 'chat', 'jid']) <= tables:
+            self.schema = self.MODERN
+        elif 'messages' in tables:
+            self.schema = self.LEGACY
+        else:
+            raise MsgstoreException('Unknown msgstore schema: %s' % db_path)
+
+    def close(self):
+        self.conn.close()
+
+    def has_table(self, table):
+        return bool(self._table_columns(table))
+
+    def chats(self):
+        for chat_id, (jid, subject) in sorted(self._chat_lookup().items()):
+            yield {'id': chat_id, 'jid': jid, 'subject': subject}
+
+    def contacts(self, min_jid_id=0, min_message_id=0):
+        """Yields contacts; on incremental runs only JID rows after min_jid_id (modern schema)
+        or JIDs found in messages after min_message_id (legacy schema)"""
+        if self.schema == self.MODERN:
+            sql = 'SELECT _id, raw_string, %s FROM jid WHERE _id > ? ORDER BY _id' % self._column('jid', 'type')
+
+            for row in self.query(sql, (min_jid_id,)):
+                yield {'id': row[0], 'jid': row[1], 'type': row[2]}
+        else:
+            # Legacy databases have no JID table: distinct chat and group participant JIDs
+            sql = ('SELECT key_remote_jid FROM messages WHERE _id > ? UNION '
+                   'SELECT remote_resource FROM messages WHERE _id > ? AND remote_resource IS NOT NULL '
+                   'AND remote_resource != ""')
+
+            for i, row in enumerate(self.query(sql, (min_message_id, min_message_id))):
+                yield {'id': i + 1, 'jid': row[0], 'type': None}
+
+    def messages(self, min_id=0, max_id=None):
+        """Yields normalized messages with _id in (min_id, max_id], primary key order (range scan)"""
+        where = '_id > ?' + (' AND _id <= ?' if max_id is not None else '')
+        params = (min_id, max_id) if max_id is not None else (min_id,)
+
+        if self.schema == self.MODERN:
+            return self._modern_messages(where, params)
+
+        return self._legacy_messages(where, params)
+
+    def messages_by_ids(self, ids):
+        """Yields normalized messages for the given _id list, in ascending order"""
+        ids = sorted(ids)
+
+        for i in range(0, len(ids), 500):
+            batch = ids[i:i + 500]
+            where = '_id IN (%s)' % ','.join('?' * len(batch))
+
+            if self.schema == self.MODERN:
+                rows = self._modern_messages(where, batch)
+            else:
+                rows = self._legacy_messages(where, batch)
+
+            for message in rows:
+                yield message
+
+    def edited_message_ids(self, since_timestamp, max_id):
+        """Returns (ids, max edit timestamp) of messages up to max_id edited after since_timestamp"""
+        if not self.has_table('message_edit_info'):
+            return [], since_timestamp
+
+        sql = ('SELECT message_row_id, edited_timestamp FROM message_edit_info '
+               'WHERE edited_timestamp > ? AND message_row_id <= ?')
+        ids = []
+
+        for row in self.query(sql, (since_timestamp, max_id)):
+            ids.append(row[0])
+            since_timestamp = max(since_timestamp, row[1])
+
+        return ids, since_timestamp
+
+    def max_edit_timestamp(self):
+        if not self.has_table('message_edit_info'):
+            return 0
+
+        return self.conn.execute('SELECT MAX(edited_timestamp) FROM message_edit_info').fetchone()[0] or 0
+
+    def max_message_id(self):
+        return self.conn.execute('SELECT MAX(_id) FROM %s' % self._message_table()).fetchone()[0] or 0
+
+    def max_jid_id(self):
+        if self.schema != self.MODERN:
+            return 0
+
+        return self.conn.execute('SELECT MAX(_id) FROM jid').fetchone()[0] or 0
+
+    def message_key_id(self, message_id):
+        row = self.conn.execute('SELECT key_id FROM %s WHERE _id = ?' % self._message_table(),
+                                (message_id,)).fetchone()
+
+        return row[0] if row else None
+
+    def anchors(self, max_id):
+        """Returns [id, key_id] of some messages up to max_id, used to recognize this database later"""
+        sql = 'SELECT _id, key_id FROM %s WHERE _id <= ? ORDER BY _id DESC LIMIT 1 OFFSET ?' % self._message_table()
+        anchors = []
+
+        for offset in self.ANCHOR_OFFSETS:
+            row = self.conn.execute(sql, (max_id, offset)).fetchone()
+
+            if not row:
+                break
+
+            anchors.append([row[0], row[1]])
+
+        return anchors
+
+    def matches_anchors(self, anchors):
+        """True if any anchor message is still stored under the same id
+
+        Deleted messages (e.g. the most recent one) are skipped; a different database (WhatsApp
+        reinstalled) numbers messages differently and matches none.
+        """
+        return any(key_id is not None and self.message_key_id(message_id) == key_id
+                   for message_id, key_id in anchors)
+
+    def _message_table(self):
+        return 'message' if self.schema == self.MODERN else 'messages'
+
+    def _legacy_messages(self, where, params):
+        chats = self._chat_lookup()
+        sql = ('SELECT _id, key_remote_jid, key_from_me, key_id, timestamp, status, %s, %s, %s, %s '
+               'FROM messages WHERE %s ORDER BY _id') % (
+            self._column('messages', 'media_wa_type'), self._column('messages', 'data'),
+            self._column('messages', 'remote_resource'), self._column('messages', 'media_mime_type'), where)
+
+        for row in self.query(sql, params):
+            jid = row[1]
+            from_me = bool(row[2])
+
+            if from_me:
+                sender = None
+            elif jid and jid.endswith('@g.us'):
+                sender = row[8]
+            else:
+                sender = jid
+
+            yield dict(zip(self.MESSAGE_FIELDS, (row[0], jid, chats.get(jid, (None, None))[1], from_me, sender,
+                                                 row[3], row[4], row[5], row[6], row[7], row[9])))
+
+    def _modern_messages(self, where, params):
+        chats = self._chat_lookup()
+        jids = self._jid_lookup()
+        sql = ('SELECT _id, chat_row_id, from_me, key_id, timestamp, status, %s, %s, %s '
+               'FROM message WHERE %s ORDER BY _id') % (
+            self._column('message', 'message_type'), self._column('message', 'text_data'),
+            self._column('message', 'sender_jid_row_id'), where)
+
+        for row in self.query(sql, params):
+            chat_jid, subject = chats.get(row[1], (None, None))
+            from_me = bool(row[2])
+
+            if from_me:
+                sender = None
+            elif row[8]:
+                sender = jids.get(row[8])
+            else:
+                sender = chat_jid
+
+            yield dict(zip(self.MESSAGE_FIELDS, (row[0], chat_jid, subject, from_me, sender, row[3], row[4],
+                                                 row[5], row[6], row[7], None)))
+
+    def _chat_lookup(self):
+        # Built once: chats are few compared to messages
+        if self._chats is None:
+            self._chats = {}
+
+            if self.schema == self.MODERN:
+                jids = self._jid_lookup()
+                sql = 'SELECT _id, jid_row_id, %s FROM chat' % self._column('chat', 'subject')
+
+                for row in self.query(sql):
+                    self._chats[row[0]] = (jids.get(row[1]), row[2])
+            elif self.has_table('chat_list'):
+                sql = 'SELECT key_remote_jid, %s FROM chat_list' % self._column('chat_list', 'subject')
+
+                for row in self.query(sql):
+                    self._chats[row[0]] = (row[0], row[1])
+
+        return self._chats
+
+    def _jid_lookup(self):
+        if self._jids is None:
+            self._jids = dict(self.query('SELECT _id, raw_string FROM jid'))
+
+        return self._jids
+
+    def _table_columns(self, table):
+        if table not in self._columns:
+            self._columns[table] = set(row[1] for row in self.conn.execute('PRAGMA table_info(%s)' % table))
+
+        return self._columns[table]
+
+    def _column(self, table, column):
+        # Columns missing in older/newer WhatsApp versions are read as NULL
+        return column if column in self._table_columns(table) else 'NULL'
+
+    def query(self, sql, params=()):
+        cursor = self.conn.cursor()
+        cursor.execute(sql, params)
+
+        try:
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
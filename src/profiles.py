@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import logging
+import multiprocessing
+
+from multiprocessing.pool import ThreadPool
+
+from hierarchy import LeanViewClient
+
+logger = logging.getLogger('WhatsDump')
+
+
+class EmulatorProfile:
+    def __init__(self, name, cores=None, memory=None, gpu=None, partition_size=2047):
+        self.name = name
+        self.cores = cores
+        self.memory = memory
+        self.gpu = gpu
+        self.partition_size = partition_size
+
+    def params(self):
+        params = '-partition-size %d ' % self.partition_size
+
+        if self.cores:
+            params += '-cores %d ' % self.cores
+
+        if self.memory:
+            params += '-memory %d ' % self.memory
+
+        if self.gpu:
+            params += '-gpu %s ' % self.gpu
+
+        return params
+
+    def sized_for(self, required_space):
+        """Copy of profile whose data partition fits required_space bytes on top of system/app needs"""
+        partition_size = max(self.partition_size, 1024 + required_space // 1048576)
+
+        if partition_size == self.partition_size:
+            return self
+
+        return EmulatorProfile(self.name, self.cores, self.memory, self.gpu, partition_size)
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+PROFILES = dict((profile.name, profile) for profile in [
+    # Emulator defaults (AVD config), as started before profiles existed
+    EmulatorProfile('default'),
+    EmulatorProfile('headless-fast', cores=4, memory=2048, gpu='swiftshader_indirect'),
+    EmulatorProfile('balanced', cores=2, memory=1536, gpu='swiftshader_indirect'),
+    EmulatorProfile('low-memory', cores=1, memory=1024, gpu='swiftshader_indirect'),
+])
+
+
+def host_resources():
+    """Returns (cores, RAM in MB or None if unknown)"""
+    ram = None
+
+    try:
+        ram = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 1048576
+    except (AttributeError, ValueError, OSError):
+        pass
+
+    return multiprocessing.cpu_count(), ram
+
+
+def max_instances(profile, cores, ram):
+    """Upper bound of concurrent instances the tuner tries, so it never pushes the host into swap"""
+    # Keep a core and 2 GB for host/ADB, count emulator process overhead on top of guest RAM
+    limits = [max(1, (cores - 1) // (profile.cores or 2))]
+
+    if ram:
+        limits.append(max(1, (ram - 2048) // ((profile.memory or 1536) + 512)))
+
+    return min(limits)
+
+
+class ProfileStore:
+    """Tuned profile saved by the tuner (android-sdk/emulator_profile.json)"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return None, None
+
+        with open(self.path, 'rb') as f:
+            data = json.load(f)
+
+        return EmulatorProfile.from_dict(data['profile']), data['max_instances']
+
+    def save(self, profile, instances, measurements):
+        with open(self.path + '.tmp', 'wb') as f:
+            json.dump({'profile': profile.to_dict(), 'max_instances': instances, 'measurements': measurements}, f,
+                      indent=2)
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        os.rename(self.path + '.tmp', self.path)
+
+    def get(self, name):
+        """Named profile, 'tuned' for the saved one (falls back to default)"""
+        if name == 'tuned':
+            profile, instances = self.load()
+            return profile or PROFILES['default']
+
+        return PROFILES[name]
+
+
+class ProfileTuner:
+    """Boots each candidate profile, measures boot time and UI dump latency, keeps best throughput
+
+    Instances of a profile are booted concurrently, one more at each step, until boot time or
+    dump latency degrades (DEGRADATION times the single instance figures) or the host bound is
+    reached. Throughput estimate: instances / (boot time + DUMPS_PER_JOB * dump latency).
+    """
+
+    DUMPS_PER_JOB = 100
+    DUMP_SAMPLES = 5
+    DEGRADATION = 1.5
+
+    def __init__(self, sdk, adb_client, no_accel=False):
+        self.sdk = sdk
+        self.adb_client = adb_client
+        self.no_accel = no_accel
+
+    def tune(self, candidates):
+        cores, ram = host_resources()
+        logger.info('Host resources: %d cores, %s MB RAM', cores, ram or 'unknown')
+
+        measurements = {}
+        best = None
+
+        for profile in candidates:
+            result = self._measure_profile(profile, max_instances(profile, cores, ram))
+
+            if not result:
+                logger.warning('Profile %s: emulator did not boot, skipped', profile.name)
+                continue
+
+            instances, boot_time, dump_latency = result
+            throughput = instances / (boot_time + self.DUMPS_PER_JOB * dump_latency)
+            measurements[profile.name] = {'boot_time': boot_time, 'dump_latency': dump_latency,
+                                          'max_instances': instances, 'throughput': throughput}
+
+            logger.info('Profile %s: %d instance(s), boot %.1fs, UI dump %.2fs -> %.4f jobs/s', profile.name,
+                        instances, boot_time, dump_latency, throughput)
+
+            if not best or throughput > measurements[best.name]['throughput']:
+                best = profile
+
+        if not best:
+            return None, None, measurements
+
+        return best, measurements[best.name]['max_instances'], measurements
+
+    def _measure_profile(self, profile, limit):
+        """Returns (instances, boot time, dump latency) of the largest concurrency that did not degrade"""
+        baseline = None
+        best = None
+
+        for instances in range(1, limit + 1):
+            result = self._measure(profile, instances)
+
+            if not result:
+                break
+
+            boot_time, dump_latency = result
+            logger.info('Profile %s, %d concurrent instance(s): boot %.1fs, UI dump %.2fs', profile.name, instances,
+                        boot_time, dump_latency)
+
+            if not baseline:
+                baseline = result
+            elif boot_time > baseline[0] * self.DEGRADATION or dump_latency > baseline[1] * self.DEGRADATION:
+                break
+
+            best = (instances, boot_time, dump_latency)
+
+        return best
+
+    def _measure(self, profile, instances):
+        """Boots instances at once, returns (slowest boot time, median dump latency) or None if any failed"""
+        ports = []
+        port = self.sdk.MIN_EMULATOR_PORT - 2
+
+        # Free ports only: emulators of a running daemon/worker are left alone
+        for i in range(instances):
+            port = self.sdk.find_free_port(self.adb_client, port + 2)
+
+            if not port:
+                return None
+
+            ports.append(port)
+
+        pool = ThreadPool(instances)
+        booted = []
+
+        try:
+            booted = pool.map(lambda port: self._boot(profile, port), ports)
+
+            if not all(booted):
+                return None
+
+            # All instances dump together, as they would when running jobs
+            samples = pool.map(lambda result: self._dump_latencies(result[0]), booted)
+        finally:
+            pool.close()
+            pool.join()
+
+            for result in booted:
+                if result:
+                    self.sdk.stop_emulator(self.adb_client, result[0].serial)
+
+        samples = sorted(sum(samples, []))
+
+        if not samples:
+            return None
+
+        return max(result[1] for result in booted), samples[len(samples) // 2]
+
+    def _boot(self, profile, port):
+        start = time.time()
+        device = self.sdk.start_emulator(self.adb_client, False, self.no_accel, port=port, read_only=True,
+                                         profile=profile)
+
+        if not device:
+            return None
+
+        return device, time.time() - start
+
+    def _dump_latencies(self, device):
+        vc = LeanViewClient(device)
+        samples = []
+
+        for i in range(self.DUMP_SAMPLES):
+            start = time.time()
+
+            try:
+                vc.dump()
+            except RuntimeError:
+                continue
+
+            samples.append(time.time() - start)
+
+        return samples
@@ -0,0 +1,114 @@
+import json
+import sqlite3
+import logging
+
+from msgstore import MsgstoreReader, MsgstoreException
+
+logger = logging.getLogger('WhatsDump')
+
+
+class SearchIndex:
+    """SQLite FTS5 full-text index of extracted messages, shared by any number of phones"""
+
+    SCHEMA = [
+        'CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5('
+        'text, chat UNINDEXED, chat_subject UNINDEXED, sender UNINDEXED, timestamp UNINDEXED, '
+        'phone UNINDEXED, message_id UNINDEXED, tokenize="unicode61 remove_diacritics 1")',
+        'CREATE TABLE IF NOT EXISTS indexed_phones (phone TEXT PRIMARY KEY, last_id INTEGER, last_key_id TEXT, '
+        'anchors TEXT)'
+    ]
+
+    def __init__(self, index_path, batch_size=50000, timeout=600):
+        self.index_path = index_path
+        self.batch_size = batch_size
+        # Shared by concurrent jobs: an update holds the write lock while indexing a whole msgstore
+        self.conn = sqlite3.connect(index_path, timeout=timeout)
+        self.conn.text_factory = lambda data: data.decode('utf-8', 'replace')
+
+        try:
+            for sql in self.SCHEMA:
+                self.conn.execute(sql)
+        except sqlite3.OperationalError, e:
+            raise MsgstoreException('SQLite library has no FTS5 support: %s' % e)
+
+        # Indexes created by older versions only stored key of last message
+        if 'anchors' not in set(row[1] for row in self.conn.execute('PRAGMA table_info(indexed_phones)')):
+            self.conn.execute('ALTER TABLE indexed_phones ADD COLUMN anchors TEXT')
+
+    def close(self):
+        self.conn.close()
+
+    def update(self, phone, db_path):
+        """Indexes messages of msgstore db_path added since last update of this phone, returns count"""
+        phone = str(phone)
+        reader = MsgstoreReader(db_path)
+        row = self.conn.execute('SELECT last_id, last_key_id, anchors FROM indexed_phones WHERE phone = ?',
+                                (phone,)).fetchone()
+        last_id = row[0] if row else 0
+
+        try:
+            anchors = json.loads(row[2]) if row and row[2] else [[last_id, row and row[1]]]
+
+            # A different database (e.g. WhatsApp reinstalled) renumbers messages: reindex phone
+            if last_id and not reader.matches_anchors(anchors):
+                logger.warning('Msgstore of %s does not match search index, rebuilding it', phone)
+                self.conn.execute('DELETE FROM messages_fts WHERE phone = ?', (phone,))
+                last_id = 0
+
+            max_id = reader.max_message_id()
+            count = 0
+            batch = []
+
+            for message in reader.messages(last_id, max_id):
+                if not message['text']:
+                    continue
+
+                batch.append((message['text'], message['chat'], message['chat_subject'],
+                              message['sender'] or 'me', message['timestamp'], phone, message['id']))
+
+                if len(batch) >= self.batch_size:
+                    count += self._insert(batch)
+                    batch = []
+
+            count += self._insert(batch)
+
+            self.conn.execute('INSERT OR REPLACE INTO indexed_phones (phone, last_id, last_key_id, anchors) '
+                              'VALUES (?, ?, ?, ?)', (phone, max_id, reader.message_key_id(max_id),
+                                                      json.dumps(reader.anchors(max_id))))
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+        finally:
+            reader.close()
+
+        logger.info('Indexed %d new messages of %s', count, phone)
+
+        return count
+
+    def search(self, query, phone=None, limit=50):
+        """Yields matching messages as dicts, best match first"""
+        sql = ('SELECT phone, chat, chat_subject, sender, timestamp, message_id, '
+               "snippet(messages_fts, 0, '[', ']', '...', 16) FROM messages_fts WHERE messages_fts MATCH ?")
+        params = [query]
+
+        if phone:
+            sql += ' AND phone = ?'
+            params.append(str(phone))
+
+        sql += ' ORDER BY rank LIMIT ?'
+        params.append(limit)
+
+        try:
+            for row in self.conn.execute(sql, params):
+                yield dict(zip(('phone', 'chat', 'chat_subject', 'sender', 'timestamp', 'message_id', 'snippet'),
+                               row))
+        except sqlite3.OperationalError, e:
+            raise MsgstoreException('Invalid search query: %s' % e)
+
+    def _insert(self, batch):
+        # One big transaction for the whole update, committed by caller
+        self.conn.executemany('INSERT INTO messages_fts (text, chat, chat_subject, sender, timestamp, phone, '
+                              'message_id) VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+
+        return len(batch)
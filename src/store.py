@@ -0,0 +1,181 @@
+import os
+import json
+import stat
+import time
+import shutil
+import logging
+import hashlib
+import tempfile
+import threading
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger('WhatsDump')
+
+
+class BlobStore:
+    """Content-addressed store shared by all phones and runs
+
+    Layout under root:
+      blobs/<2 hex>/<sha256>[.zst]   immutable (write bits cleared) file contents
+      manifests/<phone>/<run>.json   files of each run with their hash
+
+    Output directories keep their human-readable layout: files are hardlinks to blobs, so identical
+    files cost disk space once. Blobs are shared: linked files must be replaced (new file + rename),
+    never written in place. Compressed blobs can not be linked: output keeps the plain file and the
+    blob holds it for later runs (older versions only live in the store).
+    """
+
+    # Appended to by later runs, never linked to blobs
+    MUTABLE_FILES = ('log.txt', 'export_state.json')
+
+    COMPRESS_MIN_SIZE = 1048576
+
+    def __init__(self, root, compress=False):
+        self.root = root
+        self.compress = compress and zstandard is not None
+
+        if compress and zstandard is None:
+            logger.warning('zstandard module not installed, blobs will not be compressed')
+
+        # Store holds keys and decrypted databases: never more open than the output directory it lives in
+        self.dir_mode = stat.S_IMODE(os.stat(os.path.dirname(os.path.abspath(root))).st_mode)
+
+        for path in (root, os.path.join(root, 'blobs'), os.path.join(root, 'manifests')):
+            self._makedirs(path)
+
+    @staticmethod
+    def is_supported():
+        return hasattr(os, 'link')
+
+    def commit_run(self, phone, dst_path):
+        """Moves files of dst_path into the store and writes run manifest, returns manifest path"""
+        previous = self._last_manifest(phone)
+        files = {}
+
+        for path in self._walk(dst_path):
+            name = os.path.relpath(path, dst_path)
+            files[name] = self.put(path, previous.get(name))
+
+        manifest = {
+            'phone': str(phone),
+            'created': int(time.time()),
+            'files': files
+        }
+
+        manifest_dir = os.path.join(self.root, 'manifests', str(phone))
+        self._makedirs(manifest_dir)
+
+        manifest_path = os.path.join(manifest_dir, '%s.json' % time.strftime('%Y%m%d-%H%M%S'))
+        self._atomic_write(manifest_path, json.dumps(manifest, indent=2, sort_keys=True))
+
+        logger.info('Stored %d files (%d new blobs), manifest: %s', len(files),
+                    sum(1 for entry in files.values() if entry['new']), manifest_path)
+
+        return manifest_path
+
+    def put(self, path, previous=None):
+        """Stores file content and replaces path with a link to the blob (plain blobs only)"""
+        st = os.stat(path)
+
+        # Unchanged since last run (still linked to its blob): skip hashing
+        if previous and (st.st_ino, st.st_size, int(st.st_mtime)) == (previous['inode'], previous['size'],
+                                                                      previous['mtime']):
+            return dict(previous, new=False)
+
+        digest = self._hash(path)
+        compress = self.compress and st.st_size >= self.COMPRESS_MIN_SIZE and not path.endswith('.zst')
+        blob_path = self.blob_path(digest, compress)
+        is_new = not os.path.exists(blob_path)
+
+        if is_new:
+            self._makedirs(os.path.dirname(blob_path))
+
+            if compress:
+                self._write_compressed(path, blob_path)
+            else:
+                self._atomic_link(path, blob_path)
+
+            # Linked back into output: keep permissions of the file, only drop write access
+            os.chmod(blob_path, stat.S_IMODE(st.st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+
+        # Replace file with link to blob (atomic rename over original)
+        if not compress and not os.path.samefile(blob_path, path):
+            self._atomic_link(blob_path, path)
+
+        st = os.stat(path)
+
+        return {'sha256': digest, 'size': st.st_size, 'compressed': compress, 'inode': st.st_ino,
+                'mtime': int(st.st_mtime), 'new': is_new}
+
+    def blob_path(self, digest, compressed=False):
+        return os.path.join(self.root, 'blobs', digest[:2], digest + ('.zst' if compressed else ''))
+
+    def _makedirs(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+            os.chmod(path, self.dir_mode)
+
+    def _walk(self, dst_path):
+        for root, dirs, names in os.walk(dst_path):
+            for name in sorted(names):
+                path = os.path.join(root, name)
+
+                if name in self.MUTABLE_FILES or name.endswith('.tmp') or not os.path.isfile(path):
+                    continue
+
+                yield path
+
+    def _last_manifest(self, phone):
+        manifest_dir = os.path.join(self.root, 'manifests', str(phone))
+
+        if not os.path.isdir(manifest_dir):
+            return {}
+
+        manifests = sorted(os.listdir(manifest_dir))
+
+        if not manifests:
+            return {}
+
+        with open(os.path.join(manifest_dir, manifests[-1]), 'rb') as f:
+            return json.load(f)['files']
+
+    def _hash(self, path):
+        sha = hashlib.sha256()
+
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1048576), b''):
+                sha.update(chunk)
+
+        return sha.hexdigest()
+
+    def _atomic_link(self, src_path, dst_path):
+        tmp_path = '%s.%d.%d.tmp' % (dst_path, os.getpid(), threading.current_thread().ident)
+
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            # Different filesystem: copy content instead
+            with open(src_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1048576)
+
+        os.rename(tmp_path, dst_path)
+
+    def _write_compressed(self, src_path, dst_path):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(dst_path), suffix='.tmp')
+
+        with os.fdopen(fd, 'wb') as dst, open(src_path, 'rb') as src:
+            zstandard.ZstdCompressor(threads=-1).copy_stream(src, dst)
+
+        os.rename(tmp_path, dst_path)
+
+    def _atomic_write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        os.rename(tmp_path, path)
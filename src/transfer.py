@@ -0,0 +1,259 @@
+import os
+import re
+import time
+import socket
+import hashlib
+import logging
+import threading
+
+from multiprocessing.pool import ThreadPool
+from adb.protocol import Protocol
+from adb.sync import Sync
+from adb.sync.stats import S_IFREG
+from log_pipeline import propagate
+
+logger = logging.getLogger('WhatsDump')
+
+# Device hash tools by preference (toybox of older images lacks sha256sum), with matching hashlib name
+HASH_TOOLS = [('sha256sum', 'sha256'), ('sha1sum', 'sha1'), ('md5sum', 'md5')]
+
+# Free space needed besides staged+assembled file: WhatsApp restores its own copy of msgstore
+SPACE_MARGIN = 268435456
+
+
+class TransferException:
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def required_space(size):
+    """Device bytes needed to push a file of given size and let WhatsApp restore it"""
+    return size * 2 + SPACE_MARGIN
+
+
+def parse_size(value):
+    """Parses df sizes: 1K blocks count or human readable (1.9G, 512M, ...)"""
+    match = re.match(r'^([\d.]+)([KMGT]?)$', value.upper())
+
+    if not match:
+        raise ValueError('Unknown size %s' % value)
+
+    number, unit = match.groups()
+
+    if not unit:
+        return int(number) * 1024
+
+    return int(float(number) * 1024 ** ('KMGT'.index(unit) + 1))
+
+
+class _Progress:
+    INTERVAL = 5
+
+    def __init__(self, total, done=0):
+        self.total = total
+        self.done = done
+        self.start_done = done
+        self.start = time.time()
+        self.last = 0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.done += size
+            now = time.time()
+
+            if now - self.last < self.INTERVAL and self.done < self.total:
+                return
+
+            self.last = now
+            elapsed = max(now - self.start, 0.001)
+
+            logger.info('Pushed %d/%d MB (%d%%, %.1f MB/s)', self.done / 1048576, self.total / 1048576,
+                        self.done * 100 / max(self.total, 1), (self.done - self.start_done) / elapsed / 1048576)
+
+
+class ChunkedPusher:
+    """Pushes large files in parts over parallel sync connections
+
+    Parts are staged in /data/local/tmp/whatsdump/<hash>/ (outside /sdcard/WhatsApp, which is wiped before
+    each registration) and renamed once complete: a retried push only sends missing parts. Parts are then
+    appended to destination, which is verified against local hash.
+    """
+
+    STAGING_DIR = '/data/local/tmp/whatsdump'
+    RETRIES = 3
+
+    def __init__(self, adb_client, chunk_size=33554432, workers=4):
+        self.adb_client = adb_client
+        self.chunk_size = chunk_size
+        self.workers = workers
+
+    def free_space(self, path):
+        """Free bytes on filesystem of path, None if unknown"""
+        lines = self.adb_client.shell('df -k %s' % path).strip().splitlines()
+
+        if len(lines) < 2:
+            return None
+
+        header = lines[0].split()
+        fields = lines[-1].split()
+
+        # toybox: "Filesystem 1K-blocks Used Available ...", toolbox: "Filesystem Size Used Free Blksize"
+        for column in ('Available', 'Free'):
+            if column in header and header.index(column) < len(fields):
+                try:
+                    return parse_size(fields[header.index(column)])
+                except ValueError:
+                    return None
+
+        return None
+
+    def check_space(self, size, path='/data'):
+        free = self.free_space(path)
+
+        if free is None:
+            logger.warning('Could not read free device storage, pushing anyway')
+            return
+
+        if free < required_space(size):
+            raise TransferException('Not enough device storage: %d MB free, %d MB needed '
+                                    '(start emulator with larger partition)'
+                                    % (free / 1048576, required_space(size) / 1048576))
+
+    def push(self, src, dest):
+        size = os.path.getsize(src)
+        tool, algorithm = self._hash_tool()
+        digest = self._hash(src, algorithm or 'sha256')
+
+        self.check_space(size)
+
+        staging = '%s/%s' % (self.STAGING_DIR, digest[:16])
+        parts = [(i, offset, min(self.chunk_size, size - offset))
+                 for i, offset in enumerate(range(0, size, self.chunk_size))] or [(0, 0, 0)]
+
+        # Keep parts of this file (resume), drop leftovers of other transfers
+        self.adb_client.shell('mkdir -p %s; for d in %s/*; do [ "$d" = "%s" ] || rm -rf "$d"; done'
+                              % (staging, self.STAGING_DIR, staging))
+
+        completed = set(self.adb_client.shell('ls %s' % staging).split())
+        missing = [part for part in parts if self._part_name(part[0]) not in completed]
+
+        progress = _Progress(size, sum(part[2] for part in parts if part not in missing))
+
+        if len(missing) < len(parts):
+            logger.info('Resuming push: %d of %d parts already on device', len(parts) - len(missing), len(parts))
+
+        pool = ThreadPool(min(self.workers, max(len(missing), 1)))
+
+        try:
+            failed = [part for part, ok in zip(missing, pool.map(
+                propagate(lambda part: self._push_part(src, staging, part, progress)), missing)) if not ok]
+        finally:
+            pool.close()
+            pool.join()
+
+        if failed:
+            raise TransferException('Could not push %d part(s) of %s, run again to resume'
+                                    % (len(failed), os.path.basename(src)))
+
+        self._assemble(staging, dest)
+        self._verify(src, dest, size, tool, digest)
+
+        self.adb_client.shell('rm -rf %s' % staging)
+
+    def _push_part(self, src, staging, part, progress):
+        index, offset, length = part
+        path = '%s/%s' % (staging, self._part_name(index))
+
+        for attempt in range(self.RETRIES):
+            sent = []
+
+            def callback(n):
+                sent.append(n)
+                progress.add(n)
+
+            try:
+                self._push_range(src, offset, length, path + '.tmp', callback)
+
+                if self.adb_client.shell('mv %s.tmp %s && echo OK' % (path, path)).strip() == 'OK':
+                    return True
+            except (RuntimeError, socket.error, IOError), e:
+                logger.warning('Push of part %d failed (attempt %d/%d): %s', index, attempt + 1, self.RETRIES, e)
+
+            # Do not count bytes sent by failed attempt
+            progress.add(-sum(sent))
+
+        return False
+
+    def _push_range(self, src, offset, length, dest, callback):
+        # Same as Sync.push, limited to a byte range of src: uses Sync internals of pure-python-adb 0.1.5
+        # (pinned in requirements.txt), check them when upgrading
+        conn = self.adb_client.sync()
+        sync = Sync(conn)
+
+        with conn, open(src, 'rb') as f:
+            f.seek(offset)
+            sync._send_str(Protocol.SEND, '%s,%d' % (dest, Sync.DEFAULT_CHMOD | S_IFREG))
+
+            while length > 0:
+                chunk = f.read(min(Sync.DATA_MAX_LENGTH, length))
+
+                if not chunk:
+                    raise IOError('Unexpected end of %s' % src)
+
+                sync._send_length(Protocol.DATA, len(chunk))
+                conn.write(chunk)
+
+                length -= len(chunk)
+                callback(len(chunk))
+
+            sync._send_length(Protocol.DONE, int(time.time()))
+            conn._check_status()
+
+    def _assemble(self, staging, dest):
+        # Append and drop parts one by one: needs one part of extra space, not a whole copy
+        result = self.adb_client.shell('rm -f %s; for p in %s/[0-9][0-9][0-9][0-9][0-9]; do cat "$p" >> %s && rm "$p" || exit 1; done '
+                                       '&& echo OK' % (dest, staging, dest))
+
+        if result.strip() != 'OK':
+            self.adb_client.shell('rm -rf %s %s' % (staging, dest))
+            raise TransferException('Could not assemble pushed parts into %s: %s' % (dest, result.strip()))
+
+    def _verify(self, src, dest, size, tool, digest):
+        if not tool:
+            logger.warning('No hash tool on device, checking %s size only', os.path.basename(dest))
+
+            if self.adb_client.shell('stat -c %%s %s' % dest).strip() != str(size):
+                raise TransferException('Size of pushed %s does not match local file' % os.path.basename(src))
+
+            return
+
+        device_digest = self.adb_client.shell('%s %s' % (tool, dest)).split(' ')[0].strip()
+
+        if device_digest != digest:
+            self.adb_client.shell('rm -f %s' % dest)
+            raise TransferException('%s mismatch of pushed %s (device %s, local %s)'
+                                    % (tool, os.path.basename(src), device_digest, digest))
+
+        logger.info('Pushed database verified on device (%s %s)', tool, digest)
+
+    def _hash_tool(self):
+        for tool, algorithm in HASH_TOOLS:
+            if len(self.adb_client.shell('echo | %s 2>/dev/null' % tool).split(' ')[0].strip()) == \
+                    hashlib.new(algorithm).digest_size * 2:
+                return tool, algorithm
+
+        return None, None
+
+    def _hash(self, path, algorithm):
+        h = hashlib.new(algorithm)
+
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1048576), b''):
+                h.update(chunk)
+
+        return h.hexdigest()
+
+    @staticmethod
+    def _part_name(index):
+        return '%05d' % index
@@ -23,3 +23,9 @@ def sha256(filename):
             hash_sha256.update(chunk)
 
     return hash_sha256.hexdigest()
+
+
+def remove_file(path):
+    # Output files may be hardlinks to shared blobs: replace them, never overwrite in place
+    if os.path.lexists(path):
+        os.remove(path)
@@ -3,8 +3,11 @@ import logging
 import time
 
 from adb import InstallError
-from utils import suppress_stderr
+from utils import suppress_stderr, remove_file
 from tools import ViewClientTools
+from hierarchy import LeanViewClient
+from code_providers import CodeProviderException
+from transfer import ChunkedPusher, TransferException
 
 logger = logging.getLogger('WhatsDump')
 
@@ -15,8 +18,14 @@ class WaException:
 
 
 class WhatsApp:
-    def __init__(self, adb_client):
+    # Full view hierarchy is logged (debug) at most once in this interval, not on every poll
+    TRAVERSE_INTERVAL = 30
+
+    def __init__(self, adb_client, ui_backend='lean'):
         self.adb_client = adb_client
+        self.ui_backend = ui_backend
+        self.verification_requested = False
+        self._last_traverse = 0
 
     def extract_msgstore(self, dst_path):
         storage_paths = [
@@ -26,13 +35,14 @@ class WhatsApp:
 
         # get most recent msgstore db path
         for spath in storage_paths:
-            db_path = self.adb_client.shell('ls -t %s/Whatsapp/Databases/msgstore* | head -1' % spath.rstrip()).rstrip()
+            db_path = self.adb_client.shell('ls -t %s/Whatsapp/Databases/msgstore* 2>/dev/null | head -1' % spath.rstrip()).rstrip()
 
             if not db_path:
                 continue
 
             dst_full_path = os.path.join(dst_path, os.path.basename(db_path))
             logger.info('Extracting msgstore database from path: %s', db_path)
+            remove_file(dst_full_path)
 
             # Returns None on success
             if self.adb_client.pull(db_path, dst_full_path) is None:
@@ -40,20 +50,59 @@ class WhatsApp:
 
         return None
 
+    def extract_msgstore_backups(self, dst_path):
+        storage_paths = [
+            self.adb_client.shell('echo $EXTERNAL_STORAGE'),
+            '/storage/emulated/0'
+        ]
+
+        # all msgstore backups, most recent first
+        for spath in storage_paths:
+            # No backups: ls error message must not be taken for file names
+            db_paths = self.adb_client.shell('ls -t %s/Whatsapp/Databases/msgstore* 2>/dev/null'
+                                             % spath.rstrip()).splitlines()
+            db_paths = [db_path.strip() for db_path in db_paths if db_path.strip()]
+            dst_full_paths = []
+
+            for db_path in db_paths:
+                dst_full_path = os.path.join(dst_path, os.path.basename(db_path))
+                logger.info('Extracting msgstore database from path: %s', db_path)
+                remove_file(dst_full_path)
+
+                # Returns None on success
+                if self.adb_client.pull(db_path, dst_full_path) is None:
+                    dst_full_paths.append(dst_full_path)
+
+            if dst_full_paths:
+                return dst_full_paths
+
+        return []
+
     def extract_priv_key(self, dst_path):
         dst_full_path = os.path.join(dst_path, 'key')
+        remove_file(dst_full_path)
 
         return self.adb_client.pull('/data/data/com.whatsapp/files/key', dst_full_path) is None
 
-    def register_phone(self, msgstore_path, country_code, phone_no, verify_method, verify_callback):
-        # Step 0: install culebra dependencies
+    def register_phone(self, msgstore_path, country_code, phone_no, verify_method, code_provider):
+        # Step 0: install culebra dependencies (full ViewClient backend only)
         tools = ViewClientTools(self.adb_client)
-        tools.install_culebra_tools()
+
+        if self.ui_backend == 'viewclient':
+            tools.install_culebra_tools()
 
         # Step 1: cleanup
         if not self._uninstall():
             raise WaException('Can not cleanup device')
 
+        # Fail early if database does not fit in emulator
+        pusher = ChunkedPusher(self.adb_client)
+
+        try:
+            pusher.check_space(os.path.getsize(msgstore_path))
+        except TransferException, e:
+            raise WaException(e.reason)
+
         # Step 2: install
         logger.info('Installing WhatsApp...')
 
@@ -70,10 +119,14 @@ class WhatsApp:
 
         # Step 3b: move msgstore.db to correct location
         logger.info('Moving extracted database into emulator...')
-        self.adb_client.push(msgstore_path, os.path.join('/sdcard/WhatsApp/Databases/', os.path.basename(msgstore_path)))
+
+        try:
+            pusher.push(msgstore_path, os.path.join('/sdcard/WhatsApp/Databases/', os.path.basename(msgstore_path)))
+        except TransferException, e:
+            raise WaException(e.reason)
 
         # FIXME?
-        vc = tools.get_viewclient()
+        vc = tools.get_viewclient() if self.ui_backend == 'viewclient' else LeanViewClient(self.adb_client)
 
         # Step 4: open whatsapp
         if not self._open_app():
@@ -87,10 +140,10 @@ class WhatsApp:
             logger.warning("Skipped allowing WhatsApp to access media/files")
             #raise WaException('Can not allow WhatsApp to access media/files')
 
-        if not self._do_verify(vc, country_code, phone_no, verify_method, verify_callback):
+        if not self._do_verify(vc, country_code, phone_no, verify_method, code_provider):
             raise WaException('Can not verify phone number')
 
-    def _do_verify(self, vc, cc, phone, method, code_callback):
+    def _do_verify(self, vc, cc, phone, method, code_provider):
         # Set country code
         cc_view = self._wait_views(vc, 'com.whatsapp:id/registration_cc')
 
@@ -121,6 +174,8 @@ class WhatsApp:
         if not next_view:
             return False
 
+        # From here on WhatsApp may send a code: registering again is rate limited
+        self.verification_requested = True
         next_view.touch()
 
         # Confirm Dialog clicking "OK"
@@ -137,10 +192,10 @@ class WhatsApp:
         # Verify by call or SMS
         if method == 'sms':
             logger.info('You should receive a SMS by WhatsApp soon')
-            self._verify_by_sms(vc, code_callback)
+            self._verify_by_sms(vc, code_provider)
         else:
             logger.info('You should receive a call by WhatsApp soon')
-            self._verify_by_call(vc, code_callback)
+            self._verify_by_call(vc, code_provider)
 
         # Restore messages
         gdrive_msg_view = self._wait_views(vc, 'android:id/message', max_tries=5)
@@ -168,9 +223,9 @@ class WhatsApp:
 
         return True
 
-    def _verify_by_sms(self, vc, code_callback):
+    def _verify_by_sms(self, vc, code_provider):
         while True:
-            code = code_callback()
+            code = self._get_code(code_provider)
 
             if code:
                 if self._try_code(vc, code):
@@ -204,7 +259,7 @@ class WhatsApp:
                 resend_view = self._wait_views(vc, 'com.whatsapp:id/resend_sms_btn')
                 resend_view.touch()
 
-    def _verify_by_call(self, vc, code_callback):
+    def _verify_by_call(self, vc, code_provider):
         request_call = True
 
         while True:
@@ -236,7 +291,7 @@ class WhatsApp:
                 call_btn_view.touch()
 
             # Ask code
-            code = code_callback()
+            code = self._get_code(code_provider)
 
             if code:
                 if self._try_code(vc, code):
@@ -249,6 +304,12 @@ class WhatsApp:
                 logger.info('Attempting to request a new Call...')
                 request_call = True
 
+    def _get_code(self, code_provider):
+        try:
+            return code_provider.get_code()
+        except CodeProviderException, e:
+            raise WaException(e.reason)
+
     def _try_code(self, vc, code):
         # Input text
         code_input_view = self._wait_views(vc, 'com.whatsapp:id/verify_sms_code_input')
@@ -393,7 +454,8 @@ class WhatsApp:
                 view = vc.findViewById(id)
 
                 if view:
-                    if logger.level == logging.DEBUG:
+                    if logger.isEnabledFor(logging.DEBUG) and time.time() - self._last_traverse >= self.TRAVERSE_INTERVAL:
+                        self._last_traverse = time.time()
                         vc.traverse()
 
                     return view
@@ -0,0 +1,159 @@
+import os
+import time
+import socket
+import logging
+import threading
+
+from job import Job, JobException
+from log_pipeline import JobLog
+from job_table import JobTableException
+from code_providers import CodeProviderException, create_code_provider
+
+logger = logging.getLogger('WhatsDump')
+
+
+class Worker:
+    """Claims jobs from a shared job table and runs them on the local emulator pool (one job per slot)"""
+
+    def __init__(self, job_table, pool, lease_seconds=120, poll_interval=5):
+        self.job_table = job_table
+        self.pool = pool
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.host = socket.gethostname()
+        self.worker_id = '%s:%d' % (self.host, os.getpid())
+
+        self._active = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @property
+    def capacity(self):
+        return self.pool.status()['running']
+
+    def run(self):
+        logger.info('Worker %s started with %d slot(s)', self.worker_id, self.capacity)
+
+        threads = [threading.Thread(target=self._slot_loop) for i in range(self.capacity)]
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            # Heartbeat: renew leases of running jobs and advertise capacity
+            while not self._stop.is_set():
+                self._heartbeat()
+                self._stop.wait(self.lease_seconds / 3.0)
+        finally:
+            self._stop.set()
+
+    def stop(self):
+        self._stop.set()
+
+    def _heartbeat(self):
+        with self._lock:
+            active = list(self._active.items())
+
+        try:
+            for job_id, job in active:
+                if not self.job_table.heartbeat(job_id, self.worker_id, self.lease_seconds):
+                    # Job was handed to another worker: stop before both register the same phone
+                    logger.warning('Lost lease of job #%d, aborting it', job_id)
+                    job.abort()
+
+            self.job_table.register_worker(self.worker_id, self.host, self.capacity, len(active))
+        except JobTableException, e:
+            logger.error('Heartbeat failed: %s', e.reason)
+
+    def _slot_loop(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.job_table.claim(self.worker_id, self.lease_seconds)
+            except JobTableException, e:
+                logger.error('Could not claim job: %s', e.reason)
+                claimed = None
+
+            if not claimed:
+                self._stop.wait(self.poll_interval)
+                continue
+
+            job_id, payload = claimed
+            job = Job.from_message(payload)
+
+            with self._lock:
+                self._active[job_id] = job
+
+            try:
+                self._process(job_id, job, payload)
+            finally:
+                with self._lock:
+                    self._active.pop(job_id, None)
+
+    def _process(self, job_id, job, payload):
+        logger.info('Running job #%d (+%s %s)', job_id, payload.get('country_code'), payload.get('phone'))
+
+        job_log = None
+        code_provider = None
+
+        # Nobody is attached to a worker: codes must come from an unattended source (retrying does not help)
+        if not payload.get('code_source') or payload['code_source'] == 'stdin':
+            logger.error('Job #%d failed: job table jobs require a file or http verification code source', job_id)
+            self._finish(job_id, False, 'Job table jobs require a file or http verification code source', retry=False)
+            return
+
+        try:
+            code_provider = create_code_provider(payload['code_source'], payload.get('code_timeout'))
+
+            job.prepare()
+
+            job_log = JobLog(os.path.join(job.dst_path, 'log.txt'), phone=str(job.phone_no), job_id=job_id,
+                             worker=self.worker_id)
+            job_log.bind()
+
+            key_path = job.execute(self.pool, code_provider, payload)
+        except JobException, e:
+            logger.error('Job #%d failed: %s', job_id, e.reason)
+            self._fail(job_id, job, e.reason, e.retry)
+            return
+        except CodeProviderException, e:
+            logger.error('Job #%d failed: %s', job_id, e.reason)
+            self._fail(job_id, job, e.reason, False)
+            return
+        except Exception, e:
+            # adb/emulator errors: only transient while no verification code was requested
+            logger.exception('Job #%d crashed', job_id)
+            self._fail(job_id, job, str(e), not job.verification_requested)
+            return
+        finally:
+            if code_provider:
+                code_provider.close()
+
+            if job_log:
+                job_log.unbind()
+
+        logger.info('Job #%d done, key extracted in %s', job_id, key_path)
+        self._finish(job_id, True, {'key': key_path, 'worker': self.worker_id, 'finished': int(time.time())})
+
+    def _fail(self, job_id, job, reason, retry):
+        if job.key_path:
+            # Registering again would not give anything more than the key already extracted
+            logger.warning('Job #%d recorded as done without its later steps', job_id)
+            self._finish(job_id, True, {'key': job.key_path, 'worker': self.worker_id, 'finished': int(time.time()),
+                                        'error': reason})
+        else:
+            self._finish(job_id, False, reason, retry)
+
+    def _finish(self, job_id, ok, result, retry=True):
+        try:
+            if ok:
+                stored = self.job_table.complete(job_id, self.worker_id, result)
+            else:
+                # Pending again while attempts are left
+                stored = self.job_table.fail(job_id, self.worker_id, result, retry)
+        except JobTableException, e:
+            logger.error('Could not store result of job #%d: %s', job_id, e.reason)
+            return
+
+        if not stored:
+            logger.warning('Job #%d was re-leased to another worker, result discarded', job_id)
@@ -5,46 +5,299 @@ import sys
 import phonenumbers
 import os
 import logging
-import re
+import socket
+import datetime
+import time
+import json
+
+from multiprocessing.pool import ThreadPool
 
-from src.utils import sha256
 from src.android_sdk import AndroidSDK
-from src.whatsapp import WhatsApp, WaException
+from src.utils import sha256
+from src.whatsapp import WhatsApp
+from src.inventory import DeviceInventory
+from src.job import Job, JobException
+from src.search import SearchIndex
+from src.msgstore import MsgstoreException
+from src.daemon import DaemonServer, DaemonClient
+from src.emulator_pool import EmulatorPool
+from src.job_table import open_job_table, JobTableException
+from src.worker import Worker
+from src.profiles import PROFILES, ProfileTuner
+from src.transfer import required_space
+from src import log_pipeline
+from src.log_pipeline import JobLog
+from src.code_providers import create_code_provider, StdinCodeProvider, CodeProviderException
 from adb.client import Client as AdbClient
 from phonenumbers.phonenumberutil import NumberParseException
 
 logger = logging.getLogger('WhatsDump')
 
 
-def wa_code_callback():
-    code = ''
+def extract_devices(devices, workers):
+    def extract(device):
+        dst_path = os.path.join(os.path.abspath('output'), 'devices', device.serial)
 
-    while len(code) != 6:
-        code = raw_input('\n>> 6-Digit Verification Code (empty string to resend): ')
-        code = code.strip()
-        code = re.sub(r'-\s*', '', code)
+        try:
+            if not os.path.exists(dst_path):
+                os.makedirs(dst_path)
 
-        # empty -> resend
-        if code == '':
+            return WhatsApp(device).extract_msgstore(dst_path)
+        except (EnvironmentError, RuntimeError), e:
+            logger.error('[%s] Extraction failed: %s', device.serial, e)
             return None
 
-    return code
+    logger.info('Extracting msgstore databases from %d devices (%d at a time)...', len(devices), workers)
 
+    pool = ThreadPool(min(workers, len(devices)))
 
-def main():
+    try:
+        results = pool.map(extract, devices)
+    finally:
+        pool.close()
+        pool.join()
+
+    for device, msgstore_path in zip(devices, results):
+        if msgstore_path:
+            logger.info('[%s] %s (SHA-256 %s)', device.serial, msgstore_path, sha256(msgstore_path))
+        else:
+            logger.error('[%s] Could not find/extract msgstore database', device.serial)
+
+    logger.info('Extract private keys with --msgstore <path> --wa-phone <phone> for each database')
+
+    return all(results)
+
+
+def build_job_request(args, phone, source_device):
+    return {
+        'country_code': phone.country_code,
+        'phone': phone.national_number,
+        'verify': args.wa_verify,
+        'msgstore': os.path.abspath(args.msgstore) if args.msgstore else None,
+        'serial': source_device.serial if source_device else None,
+        'code_source': args.wa_code_source,
+        'code_timeout': args.wa_code_timeout,
+        'ui_backend': args.ui_backend,
+        'export': args.export,
+        'export_compress': not args.no_compress,
+        'export_incremental': args.incremental,
+        'merge_backups': args.merge_backups,
+        'search_index': args.search_index if args.index else None,
+        'store': not args.no_store,
+        'store_compress': args.compress_store
+    }
+
+
+def parse_job_args(args, source_device=None):
+    """Validates phone number and verification method, logs job recap, returns parsed phone"""
+    phone = None
+
+    # Validate required phone
+    if not args.wa_phone:
+        logger.error("Please provide the phone number associated with msgstore")
+        sys.exit(1)
+    else:
+        # Add "+" if not given
+        if args.wa_phone[0] != '+':
+            args.wa_phone = '+' + args.wa_phone
+
+        try:
+            phone = phonenumbers.parse(args.wa_phone)
+        except NumberParseException:
+            pass
+
+        if not phone:
+            logger.error("Provided phone number is NOT valid")
+            sys.exit(1)
+
+    if not args.wa_verify:
+        logger.error("Please provide a WhatsApp verification method")
+        sys.exit(1)
+
+    # recap
+    if source_device:
+        logger.info('Extract WhatsApp database from device >> %s', source_device.serial)
+    else:
+        logger.info('Using msgstore database from path: %s', args.msgstore)
+
+    logger.info('Using WhatsApp phone number: +%d %d', phone.country_code, phone.national_number)
+    logger.info('Using WhatsApp verification method: %s', args.wa_verify.upper())
+
+    return phone
+
+
+def submit_to_daemon(args, request):
+    if not DaemonClient(args.daemon_socket).is_running():
+        logger.error('Cannot connect to daemon @ %s (start it with --daemon)', args.daemon_socket)
+        sys.exit(1)
+
+    yn = raw_input("\n>> Continue? (y/n): ")
+
+    if yn != 'y':
+        sys.exit(0)
+
+    # Codes typed by operator are forwarded by client, other sources are handled by daemon
+    if args.wa_code_source == 'stdin':
+        request['code_source'] = None
+
+    try:
+        key_path = DaemonClient(args.daemon_socket).submit(request, StdinCodeProvider(args.wa_code_timeout))
+    except JobException, e:
+        logger.error(e.reason)
+        sys.exit(1)
+
+    logger.info('Private key extracted in %s', key_path)
+
+
+def control_daemon(args):
+    client = DaemonClient(args.daemon_socket)
+
+    if not client.is_running():
+        logger.error('Daemon not running @ %s', args.daemon_socket)
+        sys.exit(1)
+
+    if args.daemon_stop:
+        client.shutdown()
+        logger.info('Daemon @ %s is shutting down', args.daemon_socket)
+        return
+
+    pool = client.status()['pool']
+    logger.info('Daemon @ %s: %d/%d emulator(s) running, %d idle', args.daemon_socket, pool['running'],
+                pool['size'], pool['idle'])
+
+
+def submit_job(args):
+    if not args.msgstore or args.wa_code_source == 'stdin':
+        logger.error('Submitted jobs require --msgstore and a file or http --wa-code-source')
+        sys.exit(1)
+
+    if not os.path.isfile(args.msgstore):
+        logger.error("Msgstore location is not valid (file does not exist)")
+        sys.exit(1)
+
+    phone = parse_job_args(args)
+
+    try:
+        job_id = open_job_table(args.job_table).submit(build_job_request(args, phone, None))
+    except JobTableException, e:
+        logger.error(e.reason)
+        sys.exit(1)
+
+    logger.info('Job #%d submitted to %s', job_id, args.job_table)
+
+
+def list_jobs(args):
+    try:
+        job_table = open_job_table(args.job_table)
+
+        print('Workers:')
+
+        for worker in job_table.workers():
+            print('\t%s  capacity %d, busy %d, last seen %ds ago' % (
+                worker['id'], worker['capacity'], worker['busy'], time.time() - worker['last_seen']))
+
+        print('Jobs:')
+
+        for job in job_table.jobs():
+            print('\t#%d  %-7s  +%s %s  attempts %d  %s  %s' % (
+                job['id'], job['state'], job['payload']['country_code'], job['payload']['phone'], job['attempts'],
+                job['worker'] or '', json.dumps(job['result']) if job['result'] else ''))
+    except JobTableException, e:
+        logger.error(e.reason)
+        sys.exit(1)
+
+
+def search_messages(args):
     phone = None
+
+    if args.wa_phone:
+        try:
+            phone = phonenumbers.parse(args.wa_phone if args.wa_phone[0] == '+' else '+' + args.wa_phone)
+        except NumberParseException:
+            logger.error("Provided phone number is NOT valid")
+            sys.exit(1)
+
+    if not os.path.isfile(args.search_index):
+        logger.error('Search index not found: %s (build it with --index)', args.search_index)
+        sys.exit(1)
+
+    try:
+        index = SearchIndex(args.search_index)
+
+        try:
+            for result in index.search(args.search, phone.national_number if phone else None, args.search_limit):
+                print(('%s  %s  %s  %s -> %s: %s' % (
+                    datetime.datetime.fromtimestamp(result['timestamp'] / 1000).strftime('%Y-%m-%d %H:%M:%S'),
+                    result['phone'], result['chat_subject'] or result['chat'], result['sender'],
+                    result['chat'], result['snippet'])).encode('utf-8'))
+        finally:
+            index.close()
+    except MsgstoreException, e:
+        logger.error(e.reason)
+        sys.exit(1)
+
+
+def main():
     source_device = None
     sdk = AndroidSDK()
     parser = argparse.ArgumentParser(prog='WhatsDump')
 
     parser.add_argument('--install-sdk', action='store_true', help='Download & extract latest Android SDK emulator packages')
     parser.add_argument('--msgstore', help='Location of msgstore database to decrypt')
+    parser.add_argument('--all-devices', action='store_true', help='Extract msgstore from all connected devices at once')
+    parser.add_argument('--jobs', type=int, default=4, help='Max devices queried/extracted concurrently (default: 4)')
     parser.add_argument('--wa-phone', help='WhatsApp phone number associated with msgstore database from which '
                                            'you will receive verification SMS (with prefix, ex. +393387182291)')
     parser.add_argument('--wa-verify', choices=['sms', 'call'], help='Phone verification method to use')
+    parser.add_argument('--wa-code-source', default='stdin',
+                        help='Where verification codes come from: stdin, file:<path> (file or named pipe) or '
+                             'http:[<host>:]<port> (local webhook, POST /code or /resend)')
+    parser.add_argument('--wa-code-timeout', type=int, help='Seconds to wait for each verification code')
+    parser.add_argument('--ui-backend', choices=['lean', 'viewclient'], default='lean',
+                        help='UI automation backend: lean uiautomator dumps (default) or full AndroidViewClient')
+    parser.add_argument('--merge-backups', action='store_true', help='Decrypt all msgstore backups and merge them '
+                                                                      'into output/<phone>/msgstore.db')
+    parser.add_argument('--export', choices=['jsonl', 'csv'], help='Decrypt msgstore and export messages, chats '
+                                                                    'and contacts to output/<phone>/export/')
+    parser.add_argument('--no-compress', action='store_true', help='Do not gzip exported files')
+    parser.add_argument('--incremental', action='store_true', help='Export only messages added/edited since last '
+                                                                    'export of this phone (output/<phone>/export_state.json)')
+    parser.add_argument('--index', action='store_true', help='Add messages to full-text search index')
+    parser.add_argument('--search-index', default=os.path.join(os.path.abspath('output'), 'search.db'),
+                        help='Full-text search index location, shared by all phones (default: output/search.db)')
+    parser.add_argument('--search', metavar='QUERY', help='Search indexed messages (FTS5 query syntax) and exit; '
+                                                          'restricted to --wa-phone if given')
+    parser.add_argument('--search-limit', type=int, default=50, help='Max search results (default: 50)')
+    parser.add_argument('--no-store', action='store_true', help='Keep plain output files instead of deduplicating '
+                                                                 'them into content-addressed store (output/.store/)')
+    parser.add_argument('--compress-store', action='store_true', help='Compress new store blobs with zstd')
     parser.add_argument('--verbose', action='store_true', help='Show verbose (debug) output')
     parser.add_argument('--show-emulator', action='store_true', help='Show emulator screen (by default headless)')
     parser.add_argument('--no-accel', action='store_true', help='Disable hardware acceleration (very slow emulator!)')
+    parser.add_argument('--daemon', action='store_true', help='Run as daemon keeping warm emulators ready for jobs')
+    parser.add_argument('--use-daemon', action='store_true', help='Submit job to a running daemon instead of '
+                                                                   'starting a new emulator')
+    parser.add_argument('--daemon-socket', default=os.path.abspath('whatsdump.sock'),
+                        help='Daemon Unix socket location (default: whatsdump.sock)')
+    parser.add_argument('--daemon-status', action='store_true', help='Show running daemon emulators and exit')
+    parser.add_argument('--daemon-stop', action='store_true', help='Stop running daemon and its emulators')
+    parser.add_argument('--emulator-port', type=int, default=EmulatorPool.BASE_PORT,
+                        help='First console port tried for daemon/worker emulators, ports used by other emulators '
+                             'are skipped (default: %d)' % EmulatorPool.BASE_PORT)
+    parser.add_argument('--pool-size', type=int, help='Number of warm emulators kept by daemon/worker '
+                                                      '(default: measured by --tune-emulator, or 1)')
+    parser.add_argument('--emulator-profile', choices=sorted(PROFILES) + ['tuned'], default='tuned',
+                        help='Emulator resources profile (default: tuned, as saved by --tune-emulator)')
+    parser.add_argument('--tune-emulator', action='store_true', help='Benchmark emulator profiles on this host, '
+                                                                      'save best one and max concurrent instances')
+    parser.add_argument('--job-table', default=os.path.join(os.path.abspath('output'), 'jobs.db'),
+                        help='Shared job table (SQLite file, e.g. on a shared filesystem; default: output/jobs.db)')
+    parser.add_argument('--submit', action='store_true', help='Queue job in job table instead of running it')
+    parser.add_argument('--worker', action='store_true', help='Run jobs claimed from job table on --pool-size '
+                                                               'local emulators')
+    parser.add_argument('--lease-seconds', type=int, default=120, help='Job lease duration, renewed by worker '
+                                                                        'heartbeats (default: 120)')
+    parser.add_argument('--list-jobs', action='store_true', help='Show job table jobs and workers and exit')
 
     args = parser.parse_args()
 
@@ -63,14 +316,40 @@ def main():
     # Setup logging
     logging.basicConfig(format='[%(levelname)s] %(message)s', stream=sys.stdout)
     logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+    log_pipeline.install(logger)
+
+    if args.search:
+        search_messages(args)
+        sys.exit(0)
+
+    if args.list_jobs:
+        list_jobs(args)
+        sys.exit(0)
+
+    # Queue job in shared job table, a worker will pick it up (no local SDK/ADB needed)
+    if args.submit:
+        submit_job(args)
+        sys.exit(0)
+
+    if args.daemon_status or args.daemon_stop:
+        control_daemon(args)
+        sys.exit(0)
+
+    # Thin client: daemon does all the work, no local SDK/ADB needed with a msgstore file
+    if args.use_daemon and args.msgstore:
+        if not os.path.isfile(args.msgstore):
+            logger.error("Msgstore location is not valid (file does not exist)")
+            sys.exit(1)
+
+        phone = parse_job_args(args)
+        submit_to_daemon(args, build_job_request(args, phone, None))
+        sys.exit(0)
 
     # TODO: CHECK IF JAVA IS INSTALLED
 
     # SDK Checks
-    is_avd_installed = sdk.is_avd_installed()
-
     if args.install_sdk:
-        if is_avd_installed:
+        if sdk.is_avd_installed():
             logger.error("WhatsDump AVD already installed! Remove android-sdk/ directory to reinstall Android SDK")
             sys.exit(1)
 
@@ -81,10 +360,10 @@ def main():
 
         logger.info('\nAndroid AVD successfully installed')
         sys.exit(0)
-    else:
-        if not is_avd_installed:
-            logger.error("Cannot find WhatsDump AVD; install Android SDK and emulator packages with --install-sdk")
-            sys.exit(1)
+    elif not args.use_daemon and not sdk.is_avd_installed():
+        # Daemon clients only need ADB (to extract msgstore from device)
+        logger.error("Cannot find WhatsDump AVD; install Android SDK and emulator packages with --install-sdk")
+        sys.exit(1)
 
     # Connect / Start ADB server
     adb_client = AdbClient()
@@ -103,6 +382,18 @@ def main():
             logger.error('Could not connect/start ADB server')
             sys.exit(1)
 
+    if args.tune_emulator:
+        tune_emulator(sdk, adb_client, args)
+        sys.exit(0)
+
+    if args.daemon:
+        run_daemon(sdk, adb_client, args)
+        sys.exit(0)
+
+    if args.worker:
+        run_worker(sdk, adb_client, args)
+        sys.exit(0)
+
     # Require msgstore or connected device
     if args.msgstore:
         # Check if file exists
@@ -113,95 +404,91 @@ def main():
         logger.info("Msgstore location not provided, attempting to find connected devices with ADB...\n")
 
         devices = adb_client.devices()
-        i = 0
 
         # If no devices and no msgstore, quit
         if len(devices) == 0:
             logger.error("Cannot find any connected devices")
             sys.exit(1)
 
+        # Query all devices concurrently
+        inventory = DeviceInventory(workers=args.jobs)
+        infos = inventory.scan(devices)
+
         # Show all devices
-        for device in devices:
-            print("\t[%d] %s (%s)" % (i, device.serial, device.shell('getprop ro.product.name').rstrip()))
-            i += 1
+        for i, info in enumerate(infos):
+            if info.error:
+                print("\t[%d] %s (error: %s)" % (i, info.serial, info.error))
+                continue
+
+            print("\t[%d] %s (%s, %s, Android %s) - WhatsApp %s, %d database(s), %.1f MB" % (
+                i, info.serial, info.name, info.model, info.android,
+                'installed' if info.wa_installed else 'NOT installed',
+                len(info.databases), info.databases_size / 1048576.0))
 
         print('\n')
-        while source_device is None:
-            dev_index = int(raw_input("\n>> Which device number you want to extract msgstore from?: "))
+        selected = range(len(devices)) if args.all_devices else None
 
-            if dev_index < 0 or dev_index+1 > len(devices):
+        while selected is None:
+            answer = raw_input("\n>> Which device number(s) you want to extract msgstore from? "
+                               "(comma separated, 'a' for all): ").strip()
+
+            try:
+                # Each device once: duplicates would extract into the same output path concurrently
+                selected = range(len(devices)) if answer == 'a' else sorted(set(int(x) for x in answer.split(',')))
+            except ValueError:
                 continue
 
-            source_device = devices[dev_index]
-            print('\n')
+            if any(dev_index < 0 or dev_index+1 > len(devices) for dev_index in selected):
+                selected = None
 
-    # Validate required phone
-    if not args.wa_phone:
-        logger.error("Please provide the phone number associated with msgstore")
-        sys.exit(1)
-    else:
-        # Add "+" if not given
-        if args.wa_phone[0] != '+':
-            args.wa_phone = '+' + args.wa_phone
+        print('\n')
 
-        try:
-            phone = phonenumbers.parse(args.wa_phone)
-        except NumberParseException:
-            pass
+        # Multiple devices: extract all msgstores at once, keys are extracted per phone with --msgstore
+        if len(selected) > 1:
+            if not extract_devices([devices[dev_index] for dev_index in selected], args.jobs):
+                sys.exit(1)
 
-        if not phone:
-            logger.error("Provided phone number is NOT valid")
-            sys.exit(1)
+            sys.exit(0)
 
-    if not args.wa_verify:
-        logger.error("Please provide a WhatsApp verification method")
-        sys.exit(1)
+        source_device = devices[selected[0]]
 
-    # recap
-    if source_device:
-        logger.info('Extract WhatsApp database from device >> %s', source_device.serial)
-    else:
-        logger.info('Using msgstore database from path: %s', args.msgstore)
+    phone = parse_job_args(args, source_device)
+    request = build_job_request(args, phone, source_device)
 
-    logger.info('Using WhatsApp phone number: +%d %d', phone.country_code, phone.national_number)
-    logger.info('Using WhatsApp verification method: %s', args.wa_verify.upper())
+    # Hand job over to running daemon (warm emulators)
+    if args.use_daemon:
+        submit_to_daemon(args, request)
+        sys.exit(0)
 
     yn = raw_input("\n>> Continue? (y/n): ")
 
     if yn != 'y':
         sys.exit(0)
 
-    # create phone directory tree where to store results
-    dst_path = os.path.join(os.path.abspath('output'), str(phone.national_number))
-    if not os.path.exists(dst_path):
-        try:
-            os.makedirs(dst_path)
-        except OSError:
-            logging.error('Cannot create output directory tree')
-            sys.exit(1)
-
-    log_formatter = logging.Formatter("%(asctime)s - [%(levelname)s]: %(message)s")
-    file_handler = logging.FileHandler(os.path.join(dst_path, 'log.txt'))
-    file_handler.setFormatter(log_formatter)
-    logger.addHandler(file_handler)
-
-    # Extract msgstore.db from source device, if any
-    msgstore_path = args.msgstore
-
-    if msgstore_path:
-        logger.info('Provided msgstore.db SHA-256 hash: %s', sha256(args.msgstore))
+    job = Job(phone.country_code, phone.national_number, args.wa_verify, msgstore_path=args.msgstore,
+              source_device=source_device, ui_backend=args.ui_backend)
 
-    if source_device:
-        logger.info('Extracting msgstore.db.crypt from phone to output/%ld/ ...' % phone.national_number)
+    try:
+        code_provider = create_code_provider(args.wa_code_source, args.wa_code_timeout)
+    except CodeProviderException, e:
+        logger.error(e.reason)
+        sys.exit(1)
 
-        wa = WhatsApp(source_device)
-        msgstore_path = wa.extract_msgstore(dst_path)
+    try:
+        job.prepare()
+    except JobException, e:
+        logger.error(e.reason)
+        sys.exit(1)
 
-        if not msgstore_path:
-            logger.error('Could not find/extract msgstore database from device (is WhatsApp installed?)')
-            sys.exit(1)
+    # Job log records are written as JSON lines by a background thread
+    JobLog(os.path.join(job.dst_path, 'log.txt'), phone=str(job.phone_no)).bind()
 
-        logger.info('Extracted msgstore.db SHA-256 hash: %s', sha256(msgstore_path))
+    # Extract msgstore.db from source device, if any
+    try:
+        job.extract_msgstore(args.merge_backups)
+    except JobException, e:
+        logger.error(e.reason)
+        sys.exit(1)
 
     # Start emulator and connect to it
     logger.info('Starting emulator...')
@@ -209,7 +496,12 @@ def main():
     if args.no_accel:
         logger.warn('Hardware acceleration disabled! Device might be very slow')
 
-    emulator_device = sdk.start_emulator(adb_client, args.show_emulator, args.no_accel)
+    # Data partition must hold pushed database and the copy restored by WhatsApp
+    profile = sdk.get_profile_store().get(args.emulator_profile)
+    profile = profile.sized_for(required_space(os.path.getsize(job.msgstore_path)))
+    logger.debug('Emulator data partition: %d MB', profile.partition_size)
+
+    emulator_device = sdk.start_emulator(adb_client, args.show_emulator, args.no_accel, profile=profile)
 
     if not emulator_device:
         logger.error('Could not start emulator!')
@@ -218,27 +510,134 @@ def main():
     if args.show_emulator:
         logger.info('Do not interact with the emulator!')
 
-    logger.info('Trying to register phone on emulator... (may take few minutes)')
+    try:
+        job.run(emulator_device, code_provider)
+    except JobException, e:
+        logger.error(e.reason)
+        sys.exit(1)
+    finally:
+        code_provider.close()
+        sdk.stop_emulator(adb_client, emulator_device.serial)
+
+    # Merge older backups into a single decrypted msgstore
+    if args.merge_backups:
+        try:
+            job.merge_backups()
+        except JobException, e:
+            logger.error(e.reason)
+            sys.exit(1)
+
+    # Export messages, chats and contacts from decrypted msgstore
+    if args.export:
+        try:
+            job.export(args.export, not args.no_compress, args.incremental)
+        except JobException, e:
+            logger.error(e.reason)
+            sys.exit(1)
+
+    # Update full-text search index
+    if args.index:
+        try:
+            job.index(args.search_index)
+        except JobException, e:
+            logger.error(e.reason)
+            sys.exit(1)
+
+    # Deduplicate run files into content-addressed store
+    if not args.no_store:
+        try:
+            job.store(args.compress_store)
+        except JobException, e:
+            logger.error(e.reason)
+            sys.exit(1)
+
+
+def create_pool(sdk, adb_client, args):
+    profile_store = sdk.get_profile_store()
+    pool_size = args.pool_size
+
+    # Without explicit size, run as many instances as the tuner measured safe
+    if not pool_size:
+        tuned_profile, max_instances = profile_store.load()
+        pool_size = max_instances if tuned_profile and args.emulator_profile == 'tuned' else 1
 
-    # Attempt to register phone using provided msgstore
-    wa_emu = WhatsApp(emulator_device)
+    return EmulatorPool(sdk, adb_client, size=pool_size, show_screen=args.show_emulator, no_accel=args.no_accel,
+                        profile=profile_store.get(args.emulator_profile), base_port=args.emulator_port)
+
+
+def tune_emulator(sdk, adb_client, args):
+    if args.no_accel:
+        logger.warn('Hardware acceleration disabled! Measurements will not match accelerated hosts')
+
+    tuner = ProfileTuner(sdk, adb_client, args.no_accel)
+    profile, max_instances, measurements = tuner.tune(PROFILES.values())
+
+    if not profile:
+        logger.error('Could not boot emulator with any profile')
+        sys.exit(1)
+
+    sdk.get_profile_store().save(profile, max_instances, measurements)
+    logger.info('Best profile: %s (%s), max %d concurrent instance(s); saved as "tuned" profile',
+                profile.name, profile.params().strip(), max_instances)
+
+
+def run_worker(sdk, adb_client, args):
+    if args.no_accel:
+        logger.warn('Hardware acceleration disabled! Device might be very slow')
 
     try:
-        wa_emu.register_phone(msgstore_path, phone.country_code, phone.national_number, args.wa_verify, wa_code_callback)
-    except WaException, e:
-        logger.error('Exception in verification: %s', e.reason)
+        job_table = open_job_table(args.job_table)
+    except JobTableException, e:
+        logger.error(e.reason)
         sys.exit(1)
 
-    logger.info('Phone registered successfully!')
-    logger.info('Extracting key...')
+    pool = create_pool(sdk, adb_client, args)
+
+    try:
+        if not pool.start():
+            logger.error('Could not start any emulator!')
+            sys.exit(1)
+
+        Worker(job_table, pool, lease_seconds=args.lease_seconds).run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info('Stopping emulators...')
+        pool.stop()
 
-    # Extract private key
-    if not wa_emu.extract_priv_key(dst_path):
-        logger.error('Could not extract private key!')
+
+def run_daemon(sdk, adb_client, args):
+    if not hasattr(socket, 'AF_UNIX'):
+        logger.error('Daemon mode requires Unix domain sockets support')
         sys.exit(1)
 
-    logger.info('Private key extracted in %s', os.path.join(dst_path, 'key'))
+    if DaemonClient(args.daemon_socket).is_running():
+        logger.error('Daemon already running @ %s', args.daemon_socket)
+        sys.exit(1)
+
+    if args.no_accel:
+        logger.warn('Hardware acceleration disabled! Device might be very slow')
 
+    pool = create_pool(sdk, adb_client, args)
+
+    try:
+        if not pool.start():
+            logger.error('Could not start any emulator!')
+            sys.exit(1)
+
+        server = DaemonServer(args.daemon_socket, adb_client, pool)
+        logger.info('Daemon listening @ %s with %d warm emulator(s)', args.daemon_socket, pool.status()['running'])
+
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            os.remove(args.daemon_socket)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        logger.info('Stopping emulators...')
+        pool.stop()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file